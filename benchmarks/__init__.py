@@ -0,0 +1 @@
+"""Бенчмарки импорта и чтения данных на синтетических выгрузках площадки."""
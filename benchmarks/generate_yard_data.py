@@ -0,0 +1,149 @@
+"""
+Генератор синтетических выгрузок площадки в форматах, которые принимает import_data_from_excel.
+
+Полная выгрузка: vstockno, manufacturer, modelname, modelyear, Color, Odo Reading, Engine,
+bin, xcoord, cost, inventoried, breakevendate, dismantled, sales.
+Выгрузка цвета/пробега/двигателя: Stock #, Color, Odo Reading, Engine.
+
+Пример:
+    python -m benchmarks.generate_yard_data --cars 10000 --snapshots 3 --format csv --out /tmp/yard
+"""
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+FIRST_STOCKN = 10400
+
+MAKES = {
+    "Ford": ["F150", "Focus", "Escape", "Fusion", "Explorer"],
+    "Honda": ["Civic", "Accord", "CR-V", "Odyssey"],
+    "Toyota": ["Camry", "Corolla", "RAV4", "Sienna", "Tacoma"],
+    "Chevrolet": ["Silverado", "Malibu", "Equinox", "Impala"],
+    "Nissan": ["Altima", "Sentra", "Rogue"],
+    "Jeep": ["Cherokee", "Wrangler", "Liberty"],
+}
+COLORS = ["White", "Black", "Silver", "Gray", "Red", "Blue", "Green"]
+ENGINES = ["1.8L I4", "2.0L I4", "2.5L I4", "3.5L V6", "5.0L V8"]
+
+
+def generate_yard(cars: int, seed: int = 0, start: date = date(2023, 1, 1)) -> pd.DataFrame:
+    """
+    Базовый состав площадки: по строке на машину с постоянными атрибутами.
+    Около 1% строк имеют stockn ниже 10400 (импорт их отбрасывает), часть полей пустые,
+    как в реальных выгрузках. daily_sales — средний доход машины в день для построения истории.
+    """
+    rng = np.random.default_rng(seed)
+    makes = rng.choice(list(MAKES), cars)
+    models = [rng.choice(MAKES[make]) for make in makes]
+    stockn = FIRST_STOCKN + rng.permutation(cars * 2)[:cars]
+    below_range = rng.random(cars) < 0.01
+    stockn[below_range] = rng.integers(1000, FIRST_STOCKN, int(below_range.sum()))
+
+    inventoried = pd.to_datetime(start) + pd.to_timedelta(rng.integers(0, 540, cars), unit="D")
+    cost = rng.choice([250, 400, 600, 850, 1200, 1800, 2500], cars).astype(float)
+    daily_sales = cost * rng.uniform(0.001, 0.02, cars)
+
+    yard = pd.DataFrame({
+        "vstockno": stockn,
+        "manufacturer": makes,
+        "modelname": models,
+        "modelyear": rng.integers(1998, 2020, cars),
+        "Color": rng.choice(COLORS, cars),
+        "Odo Reading": [f"{value:,} mi" for value in rng.integers(20_000, 300_000, cars)],
+        "Engine": rng.choice(ENGINES, cars),
+        "bin": rng.choice(["A", "B", "C", "D"], cars) + rng.integers(1, 40, cars).astype(str),
+        "xcoord": rng.integers(1, 20, cars).astype(str),
+        "cost": cost,
+        "inventoried": inventoried,
+        "breakevendate": inventoried + pd.to_timedelta((cost / daily_sales).clip(max=900).astype(int), unit="D"),
+        "dismantled": pd.NaT,
+        "daily_sales": daily_sales,
+    })
+
+    # Пропуски, которые встречаются в выгрузках
+    for column, share in (("Color", 0.05), ("Engine", 0.1), ("Odo Reading", 0.05), ("modelname", 0.01)):
+        yard.loc[rng.random(cars) < share, column] = None
+    yard.loc[rng.random(cars) < 0.2, "breakevendate"] = pd.NaT
+    return yard
+
+
+def generate_snapshots(yard: pd.DataFrame, snapshots: int, seed: int = 0, first_date: date = None,
+                       step_days: int = 30) -> list:
+    """
+    История выгрузок за несколько дат: [(дата, DataFrame полной выгрузки), ...].
+    В каждой следующей выгрузке sales растут, часть машин разбирается (dismantled),
+    а машины с inventoried позже даты снимка в выгрузку не попадают (по умолчанию первая дата
+    выбирается так, чтобы в следующих выгрузках появлялись новые машины).
+    """
+    rng = np.random.default_rng(seed + 1)
+    first_date = first_date or yard["inventoried"].quantile(0.8).date()
+    dismantle_after = pd.to_timedelta(rng.integers(60, 900, len(yard)), unit="D")
+    result = []
+    for index in range(snapshots):
+        snapshot_date = first_date + timedelta(days=index * step_days)
+        on_yard = yard[yard["inventoried"] <= pd.Timestamp(snapshot_date)].copy()
+        age = (pd.Timestamp(snapshot_date) - on_yard["inventoried"]).dt.days
+        on_yard["sales"] = (age * on_yard["daily_sales"]).round(2)
+        dismantled = on_yard["inventoried"] + dismantle_after[on_yard.index]
+        on_yard["dismantled"] = dismantled.where(dismantled <= pd.Timestamp(snapshot_date))
+        frame = on_yard.drop(columns="daily_sales").sample(frac=1, random_state=seed + index)
+        for column in ("inventoried", "breakevendate", "dismantled"):
+            frame[column] = frame[column].dt.date
+        result.append((snapshot_date, frame.reset_index(drop=True)))
+    return result
+
+
+def generate_color_export(yard: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    """Выгрузка с колонками Stock #, Color, Odo Reading, Engine для импорта только цвета/пробега/двигателя."""
+    rng = np.random.default_rng(seed + 2)
+    frame = yard[["vstockno", "Color", "Odo Reading", "Engine"]].rename(columns={"vstockno": "Stock #"})
+    repainted = rng.random(len(frame)) < 0.1
+    frame.loc[repainted, "Color"] = rng.choice(COLORS, int(repainted.sum()))
+    return frame.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def write_export(frame: pd.DataFrame, path) -> Path:
+    """Записывает выгрузку в xlsx или csv в зависимости от расширения пути."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".csv":
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_excel(path, index=False)
+    return path
+
+
+def generate_files(out_dir, cars: int, snapshots: int, file_format: str = "xlsx", seed: int = 0) -> dict:
+    """
+    Записывает набор файлов для одного масштаба: полные выгрузки по датам и выгрузку цвета.
+    Возвращает {"snapshots": [(дата, путь), ...], "color": путь}.
+    """
+    out_dir = Path(out_dir)
+    yard = generate_yard(cars, seed)
+    files = {"snapshots": [], "color": None}
+    for snapshot_date, frame in generate_snapshots(yard, snapshots, seed):
+        path = write_export(frame, out_dir / f"yard_{cars}_{snapshot_date:%Y%m%d}.{file_format}")
+        files["snapshots"].append((snapshot_date, path))
+    files["color"] = write_export(generate_color_export(yard, seed), out_dir / f"yard_{cars}_color.{file_format}")
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетических выгрузок площадки")
+    parser.add_argument("--cars", type=int, default=1000, help="Количество машин")
+    parser.add_argument("--snapshots", type=int, default=3, help="Количество дат выгрузки")
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_data", help="Каталог для файлов")
+    args = parser.parse_args()
+
+    files = generate_files(args.out, args.cars, args.snapshots, args.format, args.seed)
+    for snapshot_date, path in files["snapshots"]:
+        print(f"{snapshot_date}: {path}")
+    print(f"color: {files['color']}")
+
+
+if __name__ == "__main__":
+    main()
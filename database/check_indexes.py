@@ -0,0 +1,83 @@
+import sys
+from sqlalchemy import text
+from database.db import get_engine
+
+# Горячие запросы и индексы, которые они должны использовать.
+# Параметры подставляются произвольные: проверяется форма плана, а не результат.
+HOT_QUERIES = [
+    (
+        "Последняя запись Profits по stockn",
+        "SELECT cumulative_amount FROM profits WHERE stockn = 10400 ORDER BY date DESC LIMIT 1",
+        {"ix_profits_stockn_date_desc"},
+    ),
+    (
+        "Последние записи Profits для набора stockn (DISTINCT ON)",
+        "SELECT DISTINCT ON (stockn) stockn, cumulative_amount FROM profits "
+        "WHERE stockn IN (10400, 10401, 10402) ORDER BY stockn, date DESC",
+        {"ix_profits_stockn_date_desc"},
+    ),
+    (
+        "Машины по набору stockn при импорте",
+        "SELECT id, stockn FROM cars WHERE stockn IN (10400, 10401, 10402)",
+        {"ix_cars_stockn"},
+    ),
+    (
+        "Удаление Profits по import_ref",
+        "SELECT id FROM profits WHERE import_ref = 1 LIMIT 10000",
+        {"ix_profits_import_ref"},
+    ),
+    (
+        "Удаление Cars по import_ref",
+        "SELECT id FROM cars WHERE import_ref = 1 LIMIT 10000",
+        {"ix_cars_import_ref"},
+    ),
+    (
+        "Последнее состояние машин",
+        "SELECT cumulative_amount FROM car_latest_state WHERE stockn IN (10400, 10401)",
+        {"car_latest_state_pkey"},
+    ),
+]
+
+def _plan_indexes(node: dict) -> set:
+    """Собирает имена индексов из всех узлов плана EXPLAIN (FORMAT JSON)."""
+    indexes = {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", []):
+        indexes |= _plan_indexes(child)
+    return indexes
+
+def check_hot_query_plans(engine) -> list:
+    """
+    Выполняет EXPLAIN для горячих запросов и проверяет, что в плане используется ожидаемый индекс.
+    Последовательное сканирование отключается (enable_seqscan = off), чтобы на маленькой базе
+    планировщик показал, может ли запрос вообще использовать индекс.
+
+    :return: Список (описание, ожидаемые индексы, использованные индексы, ok)
+    """
+    results = []
+    with engine.connect() as connection:
+        with connection.begin():
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            partitioned = dict(connection.execute(text(
+                "SELECT child.relname, parent.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE child.relkind = 'i'"
+            )).all())
+            for description, query, expected in HOT_QUERIES:
+                plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+                used = _plan_indexes(plan[0]["Plan"])
+                # Для секционированных таблиц в плане стоят индексы секций: добавляем их родительские индексы
+                used |= {partitioned[name] for name in used if name in partitioned}
+                results.append((description, expected, used, bool(expected & used)))
+    return results
+
+def main() -> int:
+    engine = get_engine()
+    failed = 0
+    for description, expected, used, ok in check_hot_query_plans(engine):
+        print(f"{'OK  ' if ok else 'FAIL'} {description}: ожидается {sorted(expected)}, в плане {sorted(used) or 'нет индексов'}")
+        failed += not ok
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,20 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database.models import Base  # Импортируем Base из models.py
-import config  # Файл, где указана строка подключения к БД
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import text
+from pathlib import Path
+from database.db import engine  # Общий движок приложения
 
-# Создаем движок для PostgreSQL
-engine = create_engine(config.DATABASE_URL)
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
 
-# Создаем сессию
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Создание таблиц
+# Создание и обновление таблиц через миграции Alembic
 def create_database():
-    Base.metadata.create_all(bind=engine)
+    alembic_config = Config(str(ALEMBIC_INI))
+    alembic_config.set_main_option("script_location", str(ALEMBIC_INI.parent / "migrations"))
+    with engine.begin() as connection:
+        # Миграции с заполнением таблиц могут идти дольше обычного лимита запросов
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        alembic_config.attributes["connection"] = connection
+        command.upgrade(alembic_config, "head")
     print("База данных и таблицы созданы успешно.")
 
 if __name__ == "__main__":
@@ -1,6 +1,59 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from contextlib import contextmanager
+from functools import lru_cache
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, Session
+import config
 
-engine = create_engine(DATABASE_URL)
+@lru_cache(maxsize=None)
+def get_engine() -> Engine:
+    """
+    Единственный движок с пулом соединений на процесс.
+    Все сессии приложения (страницы Streamlit, сервисы, миграции) берут соединения из этого пула,
+    поэтому число соединений к Postgres ограничено DB_POOL_SIZE + DB_MAX_OVERFLOW.
+    """
+    return create_engine(
+        config.DATABASE_URL,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args={"options": f"-c statement_timeout={config.DB_STATEMENT_TIMEOUT_MS}"},
+    )
+
+engine = get_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@contextmanager
+def session_scope() -> Session:
+    """
+    Короткоживущая сессия: фиксирует транзакцию при успешном выходе, откатывает при ошибке
+    и всегда возвращает соединение в пул.
+    """
+    session: Session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+@contextmanager
+def count_queries(target) -> dict:
+    """
+    Считает SQL-запросы, выполненные через target (Engine или Connection), пока открыт контекст.
+    Для сессии передавайте session.connection(), чтобы не учитывать запросы других пользователей пула.
+    """
+    counter = {"queries": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["queries"] += 1
+
+    event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(target, "before_cursor_execute", before_cursor_execute)
@@ -1,5 +1,8 @@
-from sqlalchemy import Column, Integer, String, Date, Float, UniqueConstraint
+import re
+from datetime import date
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, JSON, String, Date, DateTime, Float, Index, UniqueConstraint, func
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.hybrid import hybrid_property
 
 Base = declarative_base()
 
@@ -8,7 +11,7 @@ class Cars(Base):
     __tablename__ = 'cars'
 
     id = Column(Integer, primary_key=True, index=True)
-    stockn = Column(Integer, index=True)
+    stockn = Column(Integer, index=True, unique=True)  # Уникален: импорт делает INSERT ... ON CONFLICT (stockn)
     make = Column(String)
     model = Column(String)
     year = Column(Integer)
@@ -26,19 +29,128 @@ class Cars(Base):
     profit = Column(Float)  # Прибыль
     xs = Column(Float)
     status = Column(String)
-    import_id = Column(String)
+    import_id = Column(String, index=True)
+    import_ref = Column(Integer, ForeignKey('imports.id'), index=True)  # Импорт, добавивший машину
     age_last_updated = Column(Date)
+    content_hash = Column(BigInteger)  # Отпечаток полей выгрузки: импорт не перезаписывает машины без изменений
 
-# Модель для таблицы Profits
+    # Вычисляемые при чтении метрики: в SQL считаются из дат, хранимые age/payback не нужны
+    @hybrid_property
+    def current_age(self):
+        """Возраст (владение) в днях на сегодня."""
+        return (date.today() - self.inventoried).days if self.inventoried else None
+
+    @current_age.expression
+    def current_age(cls):
+        return func.current_date() - cls.inventoried
+
+    @hybrid_property
+    def current_payback(self):
+        """Время до окупаемости в днях."""
+        return (self.breakevendate - self.inventoried).days if self.breakevendate and self.inventoried else None
+
+    @current_payback.expression
+    def current_payback(cls):
+        return cls.breakevendate - cls.inventoried
+
+# Модель для таблицы Profits. Таблица секционирована по date (секция на месяц, см. миграцию 0007
+# и services/partition_service.py), поэтому первичный ключ включает date.
 class Profits(Base):
     __tablename__ = 'profits'
     __table_args__ = (
         UniqueConstraint('stockn', 'date', name='_stockn_date_uc'),
+        {'postgresql_partition_by': 'RANGE (date)'},
     )
 
-    id = Column(Integer, primary_key=True, index=True)
-    stockn = Column(Integer, index=True)  # stockn теперь Integer
-    date = Column(Date)  # Изменен на Date
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    stockn = Column(Integer)  # stockn теперь Integer; индексируется составным индексом ниже
+    date = Column(Date, primary_key=True)  # Ключ секционирования
     cumulative_amount = Column(Float)
     change_amount = Column(Float)  # Новый столбец для хранения разницы
-    import_id = Column(String)
+    import_id = Column(String, index=True)
+    import_ref = Column(Integer, ForeignKey('imports.id'), index=True)
+
+# Имена секций Profits: profits_ГГГГ_ММ и profits_default. Секции не описываются в моделях
+PROFITS_PARTITION_PATTERN = re.compile(r"^profits_(\d{4}_\d{2}|default)$")
+
+# Последняя запись по stockn (WHERE stockn = ... ORDER BY date DESC) читается index-only scan
+Index(
+    'ix_profits_stockn_date_desc', Profits.stockn, Profits.date.desc(),
+    postgresql_include=['cumulative_amount'],
+)
+
+# Модель для таблицы CarLatestState — последняя запись Profits по каждому stockn.
+# Поддерживается импортом и удалением, чтобы чтения не искали последнюю запись в истории.
+class CarLatestState(Base):
+    __tablename__ = 'car_latest_state'
+
+    stockn = Column(Integer, primary_key=True, autoincrement=False)
+    latest_date = Column(Date)  # Дата последнего снимка
+    cumulative_amount = Column(Float)  # cumulative_amount последнего снимка
+    change_amount = Column(Float)  # change_amount последнего снимка
+    snapshot_count = Column(Integer)  # Количество снимков Profits для stockn
+
+# Модель для таблицы DataVersion — счетчик изменений данных (одна строка с id = 1).
+# Импорт, удаление и правки таблиц увеличивают version, по нему сбрасывается кэш экранов.
+class DataVersion(Base):
+    __tablename__ = 'data_version'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+# Модель для таблицы ImportJob — фоновые задачи импорта: статус, прогресс и результат.
+# Хранится в базе, чтобы состояние задачи переживало переподключение браузера.
+class ImportJob(Base):
+    __tablename__ = 'import_jobs'
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, nullable=False, index=True)  # queued, running, done, failed
+    file_name = Column(String)  # Имя загруженного файла
+    file_path = Column(String)  # Сохраненная копия файла для обработки в фоне
+    snapshot_date = Column(Date)  # Дата для записи в Profits (для пакета — последняя дата)
+    snapshots = Column(JSON)  # Пакетный импорт: [{"file_name", "file_path", "date"}, ...]
+    color_mileage_engine = Column(Boolean, default=False)
+    rows_read = Column(Integer, default=0)  # Прогресс: обработано строк
+    total_rows = Column(Integer)  # Оценка числа строк файла, если известна
+    result = Column(JSON)  # Результат import_data_from_excel
+    error = Column(String)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    owner = Column(String)  # Процесс, выполняющий задачу: "хост:pid:метка"
+    heartbeat_at = Column(DateTime)  # Последний сигнал процесса-владельца
+
+# Модель для таблицы Imports — реестр импортов. Список импортов и удаление импорта
+# работают по нему и по целочисленному import_ref в Cars и Profits, а не по DISTINCT import_id.
+class Imports(Base):
+    __tablename__ = 'imports'
+
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(String, index=True)  # Метка времени импорта, как в Cars.import_id и Profits.import_id
+    snapshot_date = Column(Date)  # Дата снимка (для пакета — последняя дата)
+    snapshots = Column(Integer)  # Количество снимков Profits: 1, для пакета — число файлов, 0 — цвет/пробег/двигатель
+    file_name = Column(String)
+    file_hash = Column(String)  # SHA-256 содержимого файла (для пакета — от хешей файлов по порядку дат)
+    color_mileage_engine = Column(Boolean, default=False)
+    rows_read = Column(Integer)
+    cars_added = Column(Integer)
+    cars_updated = Column(Integer)
+    cars_unchanged = Column(Integer)  # Машины из файла без изменений (не перезаписывались)
+    profits_added = Column(Integer)
+    duration = Column(Float)  # Секунды от начала импорта до фиксации
+    created_at = Column(DateTime, server_default=func.now())
+
+# Модель для таблицы PortfolioDaily — итоги площадки по датам снимков (всего и по make)
+# для графиков динамики. Пересчитывается по затронутым датам при импорте, удалении и правках.
+class PortfolioDaily(Base):
+    __tablename__ = 'portfolio_daily'
+
+    snapshot_date = Column(Date, primary_key=True)
+    make = Column(String, primary_key=True)  # '*' — итог по всем make, '' — машины без make
+    cars_count = Column(Integer)  # Машин в снимке
+    active_count = Column(Integer)  # Из них не разобранных на дату снимка
+    total_cost = Column(Float)
+    total_cumulative = Column(Float)  # Сумма cumulative_amount
+    total_change = Column(Float)  # Сумма change_amount: продажи с предыдущего снимка
+    total_profit = Column(Float)  # Сумма cumulative_amount - cost по машинам с известными значениями
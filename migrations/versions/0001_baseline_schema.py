@@ -0,0 +1,70 @@
+"""Базовая схема: таблицы cars и profits
+
+Таблицы создаются только если их еще нет, поэтому миграция безопасна
+для баз, созданных ранее через Base.metadata.create_all.
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-11-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'cars',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('stockn', sa.Integer()),
+        sa.Column('make', sa.String()),
+        sa.Column('model', sa.String()),
+        sa.Column('year', sa.Integer()),
+        sa.Column('color', sa.String()),
+        sa.Column('milage', sa.Float()),
+        sa.Column('engine', sa.String()),
+        sa.Column('location', sa.String()),
+        sa.Column('cost', sa.Float()),
+        sa.Column('inventoried', sa.Date()),
+        sa.Column('breakevendate', sa.Date()),
+        sa.Column('dismantled', sa.Date()),
+        sa.Column('purchesdate', sa.Date()),
+        sa.Column('age', sa.Integer()),
+        sa.Column('payback', sa.Integer()),
+        sa.Column('profit', sa.Float()),
+        sa.Column('xs', sa.Float()),
+        sa.Column('status', sa.String()),
+        sa.Column('import_id', sa.String()),
+        sa.Column('age_last_updated', sa.Date()),
+        if_not_exists=True,
+    )
+    op.create_index('ix_cars_id', 'cars', ['id'], if_not_exists=True)
+    op.create_index('ix_cars_stockn', 'cars', ['stockn'], if_not_exists=True)
+
+    op.create_table(
+        'profits',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('stockn', sa.Integer()),
+        sa.Column('date', sa.Date()),
+        sa.Column('cumulative_amount', sa.Float()),
+        sa.Column('change_amount', sa.Float()),
+        sa.Column('import_id', sa.String()),
+        sa.UniqueConstraint('stockn', 'date', name='_stockn_date_uc'),
+        if_not_exists=True,
+    )
+    op.create_index('ix_profits_id', 'profits', ['id'], if_not_exists=True)
+    op.create_index('ix_profits_stockn', 'profits', ['stockn'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_table('profits')
+    op.drop_table('cars')
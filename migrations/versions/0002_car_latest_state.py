@@ -0,0 +1,46 @@
+"""Таблица car_latest_state с последней записью Profits по каждому stockn
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-11-01 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'car_latest_state',
+        sa.Column('stockn', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('latest_date', sa.Date()),
+        sa.Column('cumulative_amount', sa.Float()),
+        sa.Column('change_amount', sa.Float()),
+        sa.Column('snapshot_count', sa.Integer()),
+        if_not_exists=True,
+    )
+    # Первичное заполнение из истории Profits
+    op.execute(
+        """
+        INSERT INTO car_latest_state (stockn, latest_date, cumulative_amount, change_amount, snapshot_count)
+        SELECT DISTINCT ON (stockn)
+               stockn, date, cumulative_amount, change_amount, count(*) OVER (PARTITION BY stockn)
+        FROM profits
+        WHERE stockn IS NOT NULL
+        ORDER BY stockn, date DESC
+        ON CONFLICT (stockn) DO NOTHING
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('car_latest_state')
@@ -0,0 +1,47 @@
+"""Индексы под горячие запросы и уникальность Cars.stockn
+
+- profits (stockn, date DESC) INCLUDE (cumulative_amount): последняя запись по stockn
+  читается index-only scan; одиночный индекс по stockn становится лишним;
+- индексы по import_id в cars и profits для удаления и списка импортов;
+- уникальный индекс по cars.stockn (нужен для INSERT ... ON CONFLICT (stockn)).
+  Дубликаты stockn, оставшиеся от старого импорта, удаляются: остается строка с меньшим id.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-11-01 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_profits_stockn_date_desc', 'profits', ['stockn', sa.text('date DESC')],
+        postgresql_include=['cumulative_amount'],
+    )
+    op.drop_index('ix_profits_stockn', table_name='profits')
+    op.create_index('ix_profits_import_id', 'profits', ['import_id'])
+    op.create_index('ix_cars_import_id', 'cars', ['import_id'])
+
+    op.execute("DELETE FROM cars a USING cars b WHERE a.stockn = b.stockn AND a.id > b.id")
+    op.drop_index('ix_cars_stockn', table_name='cars')
+    op.create_index('ix_cars_stockn', 'cars', ['stockn'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cars_stockn', table_name='cars')
+    op.create_index('ix_cars_stockn', 'cars', ['stockn'])
+    op.drop_index('ix_cars_import_id', table_name='cars')
+    op.drop_index('ix_profits_import_id', table_name='profits')
+    op.create_index('ix_profits_stockn', 'profits', ['stockn'])
+    op.drop_index('ix_profits_stockn_date_desc', table_name='profits')
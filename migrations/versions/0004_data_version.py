@@ -0,0 +1,32 @@
+"""Счетчик версии данных для инвалидации кэша экранов
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-11-01 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'data_version',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.execute("INSERT INTO data_version (id, version, updated_at) VALUES (1, 0, now())")
+
+
+def downgrade() -> None:
+    op.drop_table('data_version')
@@ -0,0 +1,45 @@
+"""Таблица фоновых задач импорта
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-11-01 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'import_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('file_name', sa.String()),
+        sa.Column('file_path', sa.String()),
+        sa.Column('snapshot_date', sa.Date()),
+        sa.Column('color_mileage_engine', sa.Boolean()),
+        sa.Column('rows_read', sa.Integer()),
+        sa.Column('total_rows', sa.Integer()),
+        sa.Column('result', sa.JSON()),
+        sa.Column('error', sa.String()),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('started_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime()),
+    )
+    op.create_index('ix_import_jobs_id', 'import_jobs', ['id'])
+    op.create_index('ix_import_jobs_status', 'import_jobs', ['status'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_import_jobs_status', table_name='import_jobs')
+    op.drop_index('ix_import_jobs_id', table_name='import_jobs')
+    op.drop_table('import_jobs')
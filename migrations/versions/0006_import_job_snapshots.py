@@ -0,0 +1,26 @@
+"""Список снимков пакетной задачи импорта
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-11-01 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('import_jobs', sa.Column('snapshots', sa.JSON()))
+
+
+def downgrade() -> None:
+    op.drop_column('import_jobs', 'snapshots')
@@ -0,0 +1,108 @@
+"""Секционирование profits по диапазонам date
+
+profits пересоздается как секционированная таблица (PARTITION BY RANGE (date)) с секцией
+на каждый месяц, в котором есть данные, и секцией по умолчанию для дат без своей секции.
+Новые месячные секции создает services.partition_service.ensure_profit_partitions.
+Первичный ключ секционированной таблицы должен включать ключ секционирования: (id, date).
+Строки без date не могут попасть ни в одну секцию и удаляются (импорт всегда задает дату).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-11-01 00:00:06
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PROFITS_COLUMNS = "id, stockn, date, cumulative_amount, change_amount, import_id"
+
+
+def _profits_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('profits_id_seq')"), nullable=False),
+        sa.Column('stockn', sa.Integer()),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('cumulative_amount', sa.Float()),
+        sa.Column('change_amount', sa.Float()),
+        sa.Column('import_id', sa.String()),
+    ]
+
+
+def _create_profits_indexes():
+    op.create_index('ix_profits_id', 'profits', ['id'])
+    op.create_index('ix_profits_import_id', 'profits', ['import_id'])
+    op.create_index(
+        'ix_profits_stockn_date_desc', 'profits', ['stockn', sa.text('date DESC')],
+        postgresql_include=['cumulative_amount'],
+    )
+
+
+def _detach_old_profits():
+    """Переименовывает старую таблицу и освобождает имена ее индексов, ограничений и последовательности."""
+    op.rename_table('profits', 'profits_old')
+    op.drop_index('ix_profits_id', table_name='profits_old')
+    op.drop_index('ix_profits_import_id', table_name='profits_old')
+    op.drop_index('ix_profits_stockn_date_desc', table_name='profits_old')
+    op.drop_constraint('_stockn_date_uc', 'profits_old', type_='unique')
+    op.drop_constraint('profits_pkey', 'profits_old', type_='primary')
+    op.execute("ALTER TABLE profits_old ALTER COLUMN id DROP DEFAULT")
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    _detach_old_profits()
+    op.create_table(
+        'profits',
+        *_profits_columns(),
+        sa.PrimaryKeyConstraint('id', 'date', name='profits_pkey'),
+        sa.UniqueConstraint('stockn', 'date', name='_stockn_date_uc'),
+        postgresql_partition_by='RANGE (date)',
+    )
+    op.execute("ALTER SEQUENCE profits_id_seq OWNED BY profits.id")
+    _create_profits_indexes()
+
+    bounds = op.get_bind().execute(sa.text("SELECT min(date), max(date) FROM profits_old")).one()
+    if bounds[0] is not None:
+        month = bounds[0].replace(day=1)
+        while month <= bounds[1]:
+            upper = _next_month(month)
+            op.execute(
+                f"CREATE TABLE profits_{month:%Y_%m} PARTITION OF profits "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+            )
+            month = upper
+    op.execute("CREATE TABLE profits_default PARTITION OF profits DEFAULT")
+
+    op.execute(f"INSERT INTO profits ({PROFITS_COLUMNS}) SELECT {PROFITS_COLUMNS} FROM profits_old WHERE date IS NOT NULL")
+    op.drop_table('profits_old')
+
+
+def downgrade() -> None:
+    _detach_old_profits()
+
+    op.create_table(
+        'profits',
+        *_profits_columns()[:2],
+        sa.Column('date', sa.Date()),
+        *_profits_columns()[3:],
+        sa.PrimaryKeyConstraint('id', name='profits_pkey'),
+        sa.UniqueConstraint('stockn', 'date', name='_stockn_date_uc'),
+    )
+    op.execute("ALTER SEQUENCE profits_id_seq OWNED BY profits.id")
+    _create_profits_indexes()
+    op.execute(f"INSERT INTO profits ({PROFITS_COLUMNS}) SELECT {PROFITS_COLUMNS} FROM profits_old")
+    # Секции удаляются вместе с секционированной таблицей
+    op.drop_table('profits_old')
@@ -0,0 +1,77 @@
+"""Реестр импортов и целочисленная ссылка на импорт в cars и profits
+
+Таблица imports заполняется по уже загруженным import_id (дата снимка и количество строк
+восстанавливаются по данным, время создания — из метки import_id), затем в cars и profits
+проставляется import_ref.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-11-01 00:00:07
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'imports',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('import_id', sa.String()),
+        sa.Column('snapshot_date', sa.Date()),
+        sa.Column('snapshots', sa.Integer()),
+        sa.Column('file_name', sa.String()),
+        sa.Column('file_hash', sa.String()),
+        sa.Column('color_mileage_engine', sa.Boolean()),
+        sa.Column('rows_read', sa.Integer()),
+        sa.Column('cars_added', sa.Integer()),
+        sa.Column('cars_updated', sa.Integer()),
+        sa.Column('profits_added', sa.Integer()),
+        sa.Column('duration', sa.Float()),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index('ix_imports_id', 'imports', ['id'])
+    op.create_index('ix_imports_import_id', 'imports', ['import_id'])
+
+    for table in ('cars', 'profits'):
+        op.add_column(table, sa.Column('import_ref', sa.Integer()))
+        op.create_foreign_key(f'{table}_import_ref_fkey', table, 'imports', ['import_ref'], ['id'])
+
+    op.execute("""
+        INSERT INTO imports (import_id, snapshot_date, snapshots, color_mileage_engine, cars_added, profits_added, created_at)
+        SELECT ids.import_id, profits.snapshot_date, COALESCE(profits.snapshots, 0), profits.snapshots IS NULL,
+               COALESCE(cars.rows, 0), COALESCE(profits.rows, 0),
+               CASE WHEN ids.import_id ~ '^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}$'
+                    THEN ids.import_id::timestamp ELSE now() END
+        FROM (SELECT import_id FROM cars WHERE import_id IS NOT NULL
+              UNION SELECT import_id FROM profits WHERE import_id IS NOT NULL) ids
+        LEFT JOIN (SELECT import_id, COUNT(*) AS rows FROM cars GROUP BY import_id) cars
+            ON cars.import_id = ids.import_id
+        LEFT JOIN (SELECT import_id, MAX(date) AS snapshot_date, COUNT(DISTINCT date) AS snapshots, COUNT(*) AS rows
+                   FROM profits GROUP BY import_id) profits
+            ON profits.import_id = ids.import_id
+        ORDER BY ids.import_id
+    """)
+    for table in ('cars', 'profits'):
+        op.execute(f"UPDATE {table} SET import_ref = imports.id FROM imports WHERE {table}.import_id = imports.import_id")
+        # Индекс создается после заполнения: так быстрее, чем обновлять его на каждой строке
+        op.create_index(f'ix_{table}_import_ref', table, ['import_ref'])
+
+
+def downgrade() -> None:
+    for table in ('cars', 'profits'):
+        op.drop_index(f'ix_{table}_import_ref', table_name=table)
+        op.drop_constraint(f'{table}_import_ref_fkey', table, type_='foreignkey')
+        op.drop_column(table, 'import_ref')
+    op.drop_index('ix_imports_import_id', table_name='imports')
+    op.drop_index('ix_imports_id', table_name='imports')
+    op.drop_table('imports')
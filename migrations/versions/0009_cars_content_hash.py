@@ -0,0 +1,31 @@
+"""Отпечаток содержимого машин и счетчик машин без изменений в реестре импортов
+
+У существующих строк content_hash пустой: первый импорт после миграции перезапишет их
+и сохранит отпечаток, следующие будут пропускать машины без изменений.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-11-01 00:00:08
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cars', sa.Column('content_hash', sa.BigInteger()))
+    op.add_column('imports', sa.Column('cars_unchanged', sa.Integer()))
+
+
+def downgrade() -> None:
+    op.drop_column('imports', 'cars_unchanged')
+    op.drop_column('cars', 'content_hash')
@@ -0,0 +1,49 @@
+"""Таблица portfolio_daily: итоги площадки по датам снимков для графиков динамики
+
+Строка на дату снимка и make и итоговая строка по всем make (make = '*').
+Заполняется из текущих profits и cars; дальше ее поддерживает services.portfolio_service.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2024-11-01 00:00:09
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'portfolio_daily',
+        sa.Column('snapshot_date', sa.Date(), nullable=False),
+        sa.Column('make', sa.String(), nullable=False),
+        sa.Column('cars_count', sa.Integer()),
+        sa.Column('active_count', sa.Integer()),
+        sa.Column('total_cost', sa.Float()),
+        sa.Column('total_cumulative', sa.Float()),
+        sa.Column('total_change', sa.Float()),
+        sa.Column('total_profit', sa.Float()),
+        sa.PrimaryKeyConstraint('snapshot_date', 'make'),
+    )
+    op.execute(
+        "INSERT INTO portfolio_daily "
+        "SELECT p.date, CASE WHEN grouping(coalesce(c.make, '')) = 1 THEN '*' ELSE coalesce(c.make, '') END, "
+        "count(*), count(*) FILTER (WHERE c.dismantled IS NULL OR c.dismantled > p.date), "
+        "sum(c.cost), sum(p.cumulative_amount), sum(p.change_amount), "
+        "sum(p.cumulative_amount - c.cost) FILTER (WHERE p.cumulative_amount IS NOT NULL AND c.cost IS NOT NULL) "
+        "FROM profits p JOIN cars c ON c.stockn = p.stockn "
+        "GROUP BY GROUPING SETS ((p.date, coalesce(c.make, '')), (p.date))"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('portfolio_daily')
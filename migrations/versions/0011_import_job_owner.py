@@ -0,0 +1,31 @@
+"""Владелец и время последнего сигнала задачи импорта
+
+Задачи, оставшиеся активными после остановки процесса, помечаются как прерванные только если
+их процесс-владелец завершился или перестал обновлять heartbeat_at, а не при каждом запуске приложения.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2024-11-01 00:00:10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('import_jobs', sa.Column('owner', sa.String()))
+    op.add_column('import_jobs', sa.Column('heartbeat_at', sa.DateTime()))
+
+
+def downgrade() -> None:
+    op.drop_column('import_jobs', 'heartbeat_at')
+    op.drop_column('import_jobs', 'owner')
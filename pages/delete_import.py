@@ -1,26 +1,39 @@
 import streamlit as st
-from services.delete_service import delete_data_by_import_id, get_all_import_ids
+from services.delete_service import delete_import, get_imports
+
+def describe_import(record) -> str:
+    """Строка импорта для выпадающего списка: import_id, дата снимка, файл и число строк."""
+    parts = [record.import_id]
+    if record.snapshot_date:
+        parts.append(f"снимок {record.snapshot_date:%Y-%m-%d}" + (f" (+{record.snapshots - 1})" if (record.snapshots or 0) > 1 else ""))
+    if record.file_name:
+        parts.append(record.file_name)
+    if record.rows_read is not None:
+        parts.append(f"{record.rows_read} строк")
+    return " — ".join(parts)
 
 def main():
     st.title("Удаление данных по import_id")
 
-    # Получаем все доступные import_id
-    import_ids = get_all_import_ids()
+    # Получаем импорты из реестра
+    imports = get_imports()
 
-    if not import_ids:
+    if not imports:
         st.warning("Доступных import_id для удаления не найдено.")
         return
 
-    # Выводим выпадающий список для выбора import_id
-    selected_import_id = st.selectbox("Выберите import_id для удаления данных", import_ids)
+    # Выводим выпадающий список для выбора импорта (значения — id записей реестра)
+    imports_by_ref = {record.id: record for record in imports}
+    selected_ref = st.selectbox("Выберите import_id для удаления данных", list(imports_by_ref),
+                                format_func=lambda ref: describe_import(imports_by_ref[ref]))
 
     # Кнопка для удаления данных
     if st.button("Удалить данные"):
-        if selected_import_id:
-            result = delete_data_by_import_id(selected_import_id)
+        if selected_ref:
+            result = delete_import(selected_ref)
             st.success(f"Удалено записей: Cars - {result['cars_deleted']}, Profits - {result['profits_deleted']}")
         else:
             st.error("Пожалуйста, выберите import_id")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,12 +1,27 @@
 import streamlit as st
-from datetime import date
-from services.import_service import import_data_from_excel
+import re
+from datetime import date, datetime
+import pandas as pd
+from services.job_service import submit_import_job, submit_batch_import_job, get_import_jobs, has_active_jobs
+
+def render_import_metrics(result: dict):
+    """Время этапов импорта, скорость и число запросов."""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Время импорта, с", f"{result['duration']:.2f}")
+    with col2:
+        st.metric("Строк в секунду", f"{result['rows_per_second']:.0f}")
+    with col3:
+        st.metric("SQL-запросов", result['queries'])
+
+    timings = pd.DataFrame(list(result['timings'].items()), columns=["Этап", "Секунды"])
+    st.dataframe(timings, hide_index=True)
 
 def main():
     st.title("Импорт данных")
 
-    # Поле для загрузки файла Excel
-    uploaded_file = st.file_uploader("Загрузите файл Excel", type=["xlsx"])
+    # Поле для загрузки файла выгрузки
+    uploaded_file = st.file_uploader("Загрузите файл Excel, CSV или Parquet", type=["xlsx", "csv", "parquet"])
 
     # Поле для выбора даты
     selected_date = st.date_input("Выберите дату для записи в таблицу Profits", value=date.today())
@@ -14,21 +29,93 @@ def main():
     # Поле для галочки, если импортируем только color, mileage, engine
     color_mileage_engine = st.checkbox("Импортировать только color, mileage, engine")
 
-    # Кнопка для запуска импорта
+    # Кнопка для запуска импорта: задача ставится в очередь и выполняется в фоне
     if st.button("Импортировать данные"):
         if uploaded_file:
-            # Выполняем импорт данных, передавая все параметры
-            result = import_data_from_excel(uploaded_file, selected_date.strftime("%Y-%m-%d"), color_mileage_engine)
+            job_id = submit_import_job(uploaded_file, selected_date, color_mileage_engine)
+            st.info(f"Импорт поставлен в очередь (задача №{job_id}).")
+        else:
+            st.error("Пожалуйста, загрузите файл для импорта.")
+
+    render_batch_import()
+    render_import_jobs()
+
+def guess_snapshot_date(file_name: str) -> date:
+    """Дата снимка из имени файла (2024-01-31, 2024_01_31 или 20240131); если ее нет — сегодняшняя."""
+    match = re.search(r"(20\d{2})[-_.]?(\d{2})[-_.]?(\d{2})", file_name)
+    if match:
+        try:
+            return datetime.strptime("".join(match.groups()), "%Y%m%d").date()
+        except ValueError:
+            pass
+    return date.today()
+
+def render_batch_import():
+    """Пакетная загрузка истории: несколько полных выгрузок, у каждой своя дата снимка."""
+    with st.expander("Пакетный импорт истории (несколько дат)"):
+        uploaded_files = st.file_uploader("Загрузите файлы выгрузок", type=["xlsx", "csv", "parquet"],
+                                          accept_multiple_files=True, key="batch_files")
+        if not uploaded_files:
+            return
 
+        # Дату каждого файла можно поправить в таблице; по умолчанию она берется из имени файла
+        dates = st.data_editor(
+            pd.DataFrame({
+                "Файл": [file.name for file in uploaded_files],
+                "Дата": [guess_snapshot_date(file.name) for file in uploaded_files],
+            }),
+            column_config={"Файл": st.column_config.TextColumn(disabled=True),
+                           "Дата": st.column_config.DateColumn(required=True)},
+            hide_index=True,
+            key="batch_dates",
+        )
+
+        if st.button("Импортировать пакет"):
+            snapshot_dates = pd.to_datetime(dates["Дата"]).dt.date
+            job_id = submit_batch_import_job(list(zip(uploaded_files, snapshot_dates)))
+            st.info(f"Пакетный импорт поставлен в очередь (задача №{job_id}).")
+
+def render_job(job):
+    """Статус одной задачи импорта: прогресс для активной, результат для завершенной."""
+    title = f"№{job.id} · {job.file_name} · {job.snapshot_date}"
+    if job.status in ("queued", "running"):
+        if job.status == "queued":
+            st.progress(0.0, text=f"{title}: в очереди")
+        elif job.total_rows:
+            st.progress(min((job.rows_read or 0) / job.total_rows, 1.0),
+                        text=f"{title}: обработано {job.rows_read} из {job.total_rows} строк")
+        else:
+            st.progress(0.0, text=f"{title}: обработано {job.rows_read or 0} строк")
+    elif job.status == "failed":
+        st.error(f"{title}: ошибка — {job.error}")
+    else:
+        result = job.result
+        with st.expander(f"{title}: завершен"):
             # Выводим детализированную информацию по каждой таблице
             st.success(
                 f"Импорт завершен успешно!\n"
-                f"Добавлено в Cars: {result['cars_added']} строк, Обновлено в Cars: {result['cars_updated']} строк.\n"
+                f"Добавлено в Cars: {result['cars_added']} строк, Обновлено в Cars: {result['cars_updated']} строк, "
+                f"Без изменений: {result.get('cars_unchanged', 0)} строк.\n"
                 f"Добавлено в Profits: {result['profits_added']} строк."
             )
+            render_import_metrics(result)
 
-        else:
-            st.error("Пожалуйста, загрузите файл для импорта.")
+def render_import_jobs():
+    """Список последних задач импорта; пока есть активные задачи, фрагмент сам опрашивает их каждые 2 секунды."""
+    polling = has_active_jobs()
+    st.fragment(run_every=2 if polling else None)(_render_import_jobs)(polling)
+
+def _render_import_jobs(polling: bool):
+    jobs = get_import_jobs()
+    if not jobs:
+        return
+    st.subheader("Задачи импорта")
+    for job in jobs:
+        render_job(job)
+
+    # Все задачи завершились — полный перезапуск страницы выключает опрос
+    if polling and not any(job.status in ("queued", "running") for job in jobs):
+        st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+import streamlit as st
+import plotly.express as px
+from database.db import session_scope
+from services.table_service import get_data_version
+from services.portfolio_service import ALL_MAKES, NO_MAKE, get_portfolio_daily, get_portfolio_makes
+from services.analytics_service import compare_snapshots, get_make_revenue_history
+import pandas as pd
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_portfolio_makes(data_version: int) -> list:
+    """Список make для фильтра, закэшированный по версии данных."""
+    with session_scope() as session:
+        return get_portfolio_makes(session)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_portfolio_daily(data_version: int, make: str) -> pd.DataFrame:
+    """Готовые итоги по датам снимков из portfolio_daily; ключ кэша — версия данных и make."""
+    with session_scope() as session:
+        return get_portfolio_daily(session, make)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_make_revenue_history(data_version: int, date_from, date_to) -> pd.DataFrame:
+    """Прирост продаж по make за даты снимков интервала (DuckDB по Parquet-выгрузке или Postgres)."""
+    return get_make_revenue_history(date_from, date_to)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_snapshot_comparison(data_version: int, date_before, date_after) -> pd.DataFrame:
+    """Сравнение двух снимков по машинам, закэшированное по версии данных и датам."""
+    return compare_snapshots(date_before, date_after)
+
+
+def format_make(make: str) -> str:
+    if make == ALL_MAKES:
+        return "Все"
+    return make if make != NO_MAKE else "Без make"
+
+
+def render_portfolio_trend():
+    """Графики динамики площадки по датам снимков: доход, прибыль, стоимость и число машин."""
+    with session_scope() as session:
+        data_version = get_data_version(session)
+
+    selected_make = st.selectbox("Make", options=[ALL_MAKES] + load_portfolio_makes(data_version), format_func=format_make)
+    df = load_portfolio_daily(data_version, selected_make)
+
+    if df.empty:
+        st.warning("Нет данных для отображения.")
+        return
+
+    df = df.rename(columns={
+        "snapshot_date": "Дата",
+        "total_cumulative": "Доход",
+        "total_profit": "Прибыль",
+        "total_cost": "Стоимость",
+        "total_change": "Продажи за период",
+        "cars_count": "Машин",
+        "active_count": "Активных",
+    })
+
+    st.plotly_chart(px.line(df, x="Дата", y=["Доход", "Прибыль", "Стоимость"], markers=True,
+                            title="Доход, прибыль и стоимость"), use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(px.bar(df, x="Дата", y="Продажи за период", title="Продажи между снимками"),
+                        use_container_width=True)
+    with col2:
+        st.plotly_chart(px.line(df, x="Дата", y=["Машин", "Активных"], markers=True, title="Количество машин"),
+                        use_container_width=True)
+
+    snapshot_dates = df["Дата"].tolist()
+    render_make_revenue(data_version, snapshot_dates)
+    render_snapshot_comparison(data_version, snapshot_dates)
+
+
+def render_make_revenue(data_version: int, snapshot_dates: list):
+    """Продажи между снимками в разрезе make за выбранный интервал дат."""
+    st.subheader("Продажи по make")
+    date_from, date_to = st.select_slider("Период", options=snapshot_dates,
+                                          value=(snapshot_dates[0], snapshot_dates[-1]), key="make_revenue_period")
+    history = load_make_revenue_history(data_version, date_from, date_to)
+    if history.empty:
+        st.info("Нет продаж за выбранный период.")
+        return
+    history["make"] = history["make"].fillna(NO_MAKE).map(format_make)
+    st.plotly_chart(px.bar(history, x="date", y="change_amount", color="make",
+                           labels={"date": "Дата", "change_amount": "Продажи за период", "make": "Make"}),
+                    use_container_width=True)
+
+
+def render_snapshot_comparison(data_version: int, snapshot_dates: list):
+    """Изменение накопленной суммы по машинам между двумя снимками."""
+    st.subheader("Сравнение снимков")
+    col1, col2 = st.columns(2)
+    with col1:
+        date_before = st.selectbox("Снимок до", snapshot_dates, index=max(len(snapshot_dates) - 2, 0),
+                                   key="comparison_before")
+    with col2:
+        date_after = st.selectbox("Снимок после", snapshot_dates, index=len(snapshot_dates) - 1,
+                                  key="comparison_after")
+    comparison = load_snapshot_comparison(data_version, date_before, date_after)
+    st.dataframe(comparison.rename(columns={
+        "stockn": "Stock #", "amount_before": "До", "amount_after": "После", "difference": "Разница",
+    }), hide_index=True, use_container_width=True)
+
+
+def main():
+    render_portfolio_trend()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,51 @@
 import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
-from sqlalchemy.orm import Session
-from database.db import SessionLocal
-from services.table_service import fetch_cars_data
-from services.calculate import (
-    calculate_stock_count, calculate_total_cost, calculate_total_profit,
-    calculate_average_xs, calculate_average_until_payback, get_profit_dynamics
+from database.db import session_scope
+from services.table_service import (
+    get_data_version, fetch_cars_page, fetch_cars_totals, fetch_filter_options, STOCK_PAGE_SIZE
 )
+from services.calculate import get_profit_dynamics_batch
 import pandas as pd
+from datetime import date
 
 
-def render_filters(df: pd.DataFrame):
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_filter_options(data_version: int, as_of: date, make: str) -> dict:
+    """Значения фильтров, закэшированные по версии данных и дате (границы age зависят от даты)."""
+    with session_scope() as session:
+        return fetch_filter_options(session, make or None)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_cars_page(data_version: int, as_of: date, filters: dict, after_stockn) -> pd.DataFrame:
+    """Одна страница отфильтрованных машин; ключ кэша — версия данных, фильтры и курсор страницы."""
+    with session_scope() as session:
+        return fetch_cars_page(session, filters, after_stockn)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_cars_totals(data_version: int, as_of: date, filters: dict) -> dict:
+    """Сводные данные по всем машинам, подходящим под фильтры."""
+    with session_scope() as session:
+        return fetch_cars_totals(session, filters)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_profit_dynamics(data_version: int, stockns: tuple) -> pd.Series:
+    """Динамика прибыли машин текущей страницы, закэшированная по версии данных."""
+    with session_scope() as session:
+        return get_profit_dynamics_batch(session, list(stockns))
+
+
+def render_filters(data_version: int):
     """Отображение фильтров над таблицей."""
 
-    # Получаем уникальные значения для фильтров
-    unique_makes = [""] + sorted(df['make'].dropna().unique())
+    # Получаем уникальные значения для фильтров запросами к базе
+    options = load_filter_options(data_version, date.today(), "")
+    unique_makes = [""] + options['makes']
     unique_models = [""]
-    unique_colors = [""] + sorted(df['color'].dropna().unique())
-    unique_years = [""] + sorted(df['year'].dropna().unique())
+    unique_colors = [""] + options['colors']
+    unique_years = [""] + options['years']
     unique_statuses = ["active", "inactive", "scrap"]
 
     # Строка 1: Make, Model, Year, Color, Status
@@ -28,7 +56,7 @@ def render_filters(df: pd.DataFrame):
 
     # Обновляем список моделей на основе выбранного make
     if selected_make:
-        unique_models = [""] + sorted(df[df['make'] == selected_make]['model'].dropna().unique())
+        unique_models = [""] + load_filter_options(data_version, date.today(), selected_make)['models']
 
     with col2:
         selected_model = st.selectbox("Model", options=unique_models, index=0)
@@ -46,16 +74,16 @@ def render_filters(df: pd.DataFrame):
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        possession_min, possession_max = int(df['age'].min()), int(df['age'].max())
+        possession_min, possession_max = options['possession_range']
         possession_range = st.slider("Possession (days)", min_value=possession_min, max_value=possession_max,
                                      value=(possession_min, possession_max))
 
     with col2:
-        cost_min, cost_max = int(df['cost'].min()), int(df['cost'].max())
+        cost_min, cost_max = options['cost_range']
         cost_range = st.slider("Cost Range", min_value=cost_min, max_value=cost_max, value=(cost_min, cost_max))
 
     with col3:
-        xs_min, xs_max = float(df['xs'].min()), float(df['xs'].max())
+        xs_min, xs_max = options['xs_range']
         xs_range = st.slider("XS", min_value=xs_min, max_value=xs_max, value=(xs_min, xs_max))
 
     st.markdown("---")
@@ -72,41 +100,33 @@ def render_filters(df: pd.DataFrame):
     }
 
 
+def get_page_cursors(filters: dict) -> list:
+    """
+    Стек курсоров keyset-пагинации в session_state: None — первая страница,
+    далее последний stockn каждой пройденной страницы. При смене фильтров стек сбрасывается.
+    """
+    if st.session_state.get('stock_filters') != filters:
+        st.session_state['stock_filters'] = filters
+        st.session_state['stock_cursors'] = [None]
+    return st.session_state['stock_cursors']
+
+
 def render_stock_table():
     """Отображение таблицы Stock № с настроенными колонками и скрытыми полями."""
-    # Создаем сессию базы данных
-    session = SessionLocal()
-
-    # Получаем данные из таблицы Cars
-    df = fetch_cars_data(session)
+    # Сессия нужна только на время запроса версии; AgGrid отрисовывается без открытого соединения
+    with session_scope() as session:
+        data_version = get_data_version(session)
 
     # Вызов фильтров перед таблицей
-    filters = render_filters(df)
-
-    # Применение фильтрации по статусу перед остальными фильтрами
-    if filters['statuses']:
-        df = df[df['status'].isin(filters['statuses'])]
-
-    # Применяем фильтры по остальным параметрам
-    if filters['make']:
-        df = df[df['make'] == filters['make']]
-
-    if filters['model']:
-        df = df[df['model'] == filters['model']]
-
-    if filters['year']:
-        df = df[df['year'] == filters['year']]
+    filters = render_filters(data_version)
+    cursors = get_page_cursors(filters)
 
-    if filters['color']:
-        df = df[df['color'] == filters['color']]
+    # Фильтрация и пагинация выполняются в базе; загружается только текущая страница
+    df = load_cars_page(data_version, date.today(), filters, cursors[-1]).copy()
 
-    df = df[(df['age'] >= filters['possession_range'][0]) & (df['age'] <= filters['possession_range'][1])]
-    df = df[(df['cost'] >= filters['cost_range'][0]) & (df['cost'] <= filters['cost_range'][1])]
-    df = df[(df['xs'] >= filters['xs_range'][0]) & (df['xs'] <= filters['xs_range'][1])]
-
-    # Добавляем столбец с динамикой прибыли
-    df = df.copy()  # Создаем копию перед изменениями
-    df['dinamic'] = df['stockn'].apply(lambda stockn: " / ".join(get_profit_dynamics(session, stockn)))
+    # Добавляем столбец с динамикой прибыли (один запрос на страницу, результат кэшируется)
+    dynamics = load_profit_dynamics(data_version, tuple(df['stockn'].tolist()))
+    df['dinamic'] = df['stockn'].map(dynamics).fillna("")
 
     # Упорядочиваем столбцы в нужном порядке
     column_order = [
@@ -130,7 +150,7 @@ def render_stock_table():
     grid_options = gb.build()
 
     # Вывод таблицы с AgGrid
-    grid_response = AgGrid(
+    AgGrid(
         df,
         gridOptions=grid_options,
         update_mode=GridUpdateMode.MODEL_CHANGED,
@@ -138,26 +158,32 @@ def render_stock_table():
         editable=False,
     )
 
-    # Отфильтрованные данные
-    filtered_df = pd.DataFrame(grid_response['data'])
-
-    # Выводим сводные данные
-    render_summary(filtered_df, session)
-
-    # Закрываем сессию
-    session.close()
-
-def render_summary(filtered_df, session: Session):
+    # Переключение страниц
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("← Назад", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Страница {len(cursors)}")
+    with col_next:
+        if st.button("Вперёд →", disabled=len(df) < STOCK_PAGE_SIZE):
+            cursors.append(int(df['stockn'].iloc[-1]))
+            st.rerun()
+
+    # Выводим сводные данные по всем отфильтрованным машинам (считаются в базе)
+    render_summary(load_cars_totals(data_version, date.today(), filters))
+
+def render_summary(totals: dict):
     """Отображение сводных данных под таблицей с учетом фильтрации."""
     st.subheader("Сводные данные")
 
-    # Используем отфильтрованные данные для динамических расчетов
-    stock_count = calculate_stock_count(filtered_df)
-    total_cost = calculate_total_cost(filtered_df)
-    total_profit = calculate_total_profit(filtered_df)
+    stock_count = totals['stock_count']
+    total_cost = totals['total_cost']
+    total_profit = totals['total_profit']
     total_revenue = total_cost + total_profit
-    avg_xs = calculate_average_xs(filtered_df)
-    avg_until_payback = calculate_average_until_payback(filtered_df)
+    avg_xs = totals['avg_xs']
+    avg_until_payback = totals['avg_payback']
 
     # Создаем колонки для вывода сводных данных в одном ряду
     col1, col2, col3, col4, col5, col6 = st.columns(6)
@@ -1,54 +1,102 @@
 import streamlit as st
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
-from sqlalchemy.orm import Session
-from database.db import SessionLocal
+from sqlalchemy import update
+from st_aggrid import AgGrid, DataReturnMode, GridOptionsBuilder, GridUpdateMode
+from database.db import session_scope
 from database.models import Cars, Profits
+from services.calculate import recompute_change_amounts
+from services.latest_state_service import refresh_latest_state
+from services.partition_service import ensure_profit_partitions
+from services.table_service import (
+    bump_data_version, bulk_update_changes, count_profits, fetch_profits_block,
+    PROFITS_BLOCK_SIZE, PROFITS_GRID_COLUMNS
+)
+from services.delete_service import recalculate_cars_data
+from services.analytics_service import refresh_analytics
+from services.portfolio_service import refresh_portfolio_daily
 import pandas as pd
 
+# Вычисляемые столбцы: в гриде не редактируются, в базу из грида не записываются
+DERIVED_COLUMNS = {
+    Profits: ["change_amount"],  # Пересчитывается по соседним снимкам (recompute_change_amounts)
+}
+
 # Функции для работы с таблицами
 
 def fetch_data(table_model):
     """Получение всех данных из таблицы с сортировкой по убыванию stockn."""
-    session: Session = SessionLocal()
     try:
-        data = session.query(table_model).order_by(table_model.stockn.desc()).all()
-        return data
+        with session_scope() as session:
+            data = session.query(table_model).order_by(table_model.stockn.desc()).all()
+            session.expunge_all()
+            return data
     except Exception as e:
         st.error(f"Ошибка при получении данных: {e}")
-    finally:
-        session.close()
-
-def sanitize_value(value):
-    """Преобразование NaN в None для сохранения в базе данных."""
-    return None if pd.isna(value) else value
-
-def has_changes(updated_row, original_row):
-    """Проверка, были ли реальные изменения в строке."""
-    for key in updated_row:
-        if key != 'stockn':
-            if updated_row[key] != original_row[key]:
-                return True
-    return False
-
-def update_data(table_model, updated_rows, original_rows):
-    """Обновление данных в базе для измененных строк."""
-    session: Session = SessionLocal()
+
+def update_data(table_model, original_df: pd.DataFrame, updated_df: pd.DataFrame):
+    """
+    Сохраняет правки грида: изменения находятся векторным сравнением таблиц по id,
+    в базу отправляются только измененные ячейки пакетными UPDATE и фиксируются одним commit.
+    """
     try:
-        for updated_row, original_row in zip(updated_rows, original_rows):
-            if has_changes(updated_row, original_row):
-                record = session.query(table_model).filter_by(stockn=updated_row['stockn']).first()
-                if record:
-                    for key, value in updated_row.items():
-                        if key == "status" and value == "inactive" and original_row['status'] != "inactive":
-                            setattr(record, key, value)
-                        elif key != "stockn" and key != "id":  # Не изменяем primary_key или id
-                            setattr(record, key, sanitize_value(value))
-            session.commit()
+        with session_scope() as session:
+            changed_ids = bulk_update_changes(session, table_model, original_df, updated_df,
+                                              readonly=("id", "stockn", *DERIVED_COLUMNS.get(table_model, [])))
+            if changed_ids.empty:
+                return
+            changed_rows = original_df[original_df['id'].isin(changed_ids)]
+            changed_stockns = set(changed_rows['stockn'].dropna().astype(int))
+
+            # Ручная правка машины сбрасывает отпечаток: следующий импорт сравнит строку заново.
+            # Итоги площадки пересчитываются по снимкам измененных машин
+            if table_model is Cars:
+                session.execute(
+                    update(Cars).where(Cars.id.in_([int(value) for value in changed_ids])).values(content_hash=None)
+                )
+                refresh_portfolio_daily(session, stockns=changed_stockns)
+
+            # Правки Profits меняют change_amount следующих снимков, последнее состояние машин и их profit/xs
+            snapshot_dates = []
+            if table_model is Profits:
+                edited_rows = updated_df[updated_df['id'].isin(changed_ids)]
+                dates = pd.to_datetime(pd.concat([changed_rows['date'], edited_rows['date']]), errors='coerce')
+                snapshot_dates = dates.dropna().dt.date.unique().tolist()
+                if snapshot_dates:
+                    snapshot_dates += recompute_change_amounts(session, changed_stockns, min(snapshot_dates))
+                refresh_latest_state(session, changed_stockns)
+                recalculate_cars_data(session, changed_stockns)
+                refresh_portfolio_daily(session, snapshot_dates)
+            bump_data_version(session)
+
+        # Измененная дата могла перенести строку в секцию по умолчанию: секции месяцев создаются
+        # после фиксации правки отдельной короткой транзакцией
+        ensure_profit_partitions(snapshot_dates)
+
+        # Аналитическая выгрузка: для Profits — снимки затронутых дат (до и после правки и с пересчитанным
+        # change_amount), для Cars — только Cars
+        refresh_analytics(sorted(set(snapshot_dates)))
+        st.success(f"Сохранено строк: {len(changed_ids)}")
     except Exception as e:
-        session.rollback()
         st.error(f"Ошибка при обновлении данных: {e}")
-    finally:
-        session.close()
+
+def render_grid(table_model, table_name, df: pd.DataFrame):
+    """Редактируемый грид по DataFrame; правки сохраняются в базу через update_data."""
+    gb = GridOptionsBuilder.from_dataframe(df)
+    gb.configure_default_column(editable=True, filterable=True, sortable=True)
+    gb.configure_column('id', editable=False)  # Ключ строки для сохранения правок
+    for column in DERIVED_COLUMNS.get(table_model, []):
+        gb.configure_column(column, editable=False)
+    grid_options = gb.build()
+
+    grid_response = AgGrid(
+        df,
+        gridOptions=grid_options,
+        update_mode=GridUpdateMode.MODEL_CHANGED,
+        data_return_mode=DataReturnMode.AS_INPUT,  # Все строки в исходном порядке, а не только видимые после фильтра
+        editable=True,
+        key=f"table_{table_name}",
+    )
+
+    update_data(table_model, df, pd.DataFrame(grid_response['data']))
 
 def render_table(table_model, table_name, column_order):
     """Отображение таблицы с возможностью редактирования и сохранения изменений в базу данных."""
@@ -64,24 +112,47 @@ def render_table(table_model, table_name, column_order):
 
     df = pd.DataFrame(rows)
     df = df[column_order]
-    original_rows = df.to_dict(orient='records')
-
-    gb = GridOptionsBuilder.from_dataframe(df)
-    gb.configure_default_column(editable=True, filterable=True, sortable=True)
-    grid_options = gb.build()
-
-    grid_response = AgGrid(
-        df,
-        gridOptions=grid_options,
-        update_mode=GridUpdateMode.MODEL_CHANGED,
-        editable=True
-    )
+    render_grid(table_model, table_name, df)
+
+def render_profits_table():
+    """
+    Грид Profits с постраничной загрузкой: фильтры и сортировка выполняются в базе,
+    с сервера запрашивается только текущий блок строк.
+    """
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        stockn = st.number_input("Stock #", min_value=0, value=0, step=1, key="profits_stockn")
+    with col2:
+        date_range = st.date_input("Период", value=(), key="profits_dates")
+    with col3:
+        sort_by = st.selectbox("Сортировка", PROFITS_GRID_COLUMNS, index=PROFITS_GRID_COLUMNS.index("stockn"),
+                               key="profits_sort")
+    with col4:
+        descending = st.toggle("По убыванию", value=True, key="profits_descending")
+
+    filters = {
+        'stockn': int(stockn) or None,
+        'date_from': date_range[0] if len(date_range) > 0 else None,
+        'date_to': date_range[1] if len(date_range) > 1 else None,
+    }
 
-    updated_df = grid_response['data']
-    updated_rows = updated_df.to_dict(orient='records')
+    try:
+        with session_scope() as session:
+            total_rows = count_profits(session, filters)
+            blocks = max((total_rows - 1) // PROFITS_BLOCK_SIZE + 1, 1)
+            block = st.number_input(f"Блок (из {blocks}, по {PROFITS_BLOCK_SIZE} строк)", min_value=1,
+                                    max_value=blocks, value=1, step=1, key="profits_block")
+            df = fetch_profits_block(session, filters, sort_by, descending,
+                                     offset=(block - 1) * PROFITS_BLOCK_SIZE)
+    except Exception as e:
+        st.error(f"Ошибка при получении данных: {e}")
+        return
 
-    if not df.equals(pd.DataFrame(updated_rows)):
-        update_data(table_model, updated_rows, original_rows)
+    st.caption(f"Всего строк: {total_rows}")
+    if df.empty:
+        st.warning("Таблица Profits пуста или данные не найдены.")
+        return
+    render_grid(Profits, "Profits", df)
 
 # Главная функция
 def main():
@@ -91,18 +162,14 @@ def main():
         Cars,
         "Cars",
         column_order=[
-            "stockn", "make", "model", "year", "color", "milage", "engine",
+            "id", "stockn", "make", "model", "year", "color", "milage", "engine",
             "location", "cost", "inventoried", "breakevendate", "status", "dismantled", "import_id", "age", "payback", "profit", "xs"
         ]
     )
 
-    # Отображаем таблицу Profits
+    # Отображаем таблицу Profits блоками
     st.subheader("Таблица Profits")
-    render_table(
-        Profits,
-        "Profits",
-        column_order=["id", "stockn", "date", "cumulative_amount", "change_amount", "import_id"]
-    )
+    render_profits_table()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,179 @@
+"""
+Аналитический контур для исторических запросов по Profits.
+
+Cars и Profits выгружаются через pyarrow в Parquet (Profits — по файлу на дату снимка),
+а запросы по истории выполняются встроенным колоночным движком DuckDB поверх этих файлов,
+не нагружая рабочие таблицы Postgres. DuckDB — необязательная зависимость (pip install duckdb):
+без нее, а также пока выгрузка отстает от версии данных, те же запросы выполняются в Postgres.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import config
+from database.db import engine
+from services.table_service import get_data_version
+
+try:
+    import duckdb
+except ImportError:  # Аналитический контур необязателен
+    duckdb = None
+
+ANALYTICS_DIR = Path(config.ANALYTICS_DIR)
+MANIFEST_FILE = "manifest.json"
+EXPORT_BATCH_SIZE = 50000
+
+CARS_EXPORT_QUERY = "SELECT stockn, make, model, year, cost, inventoried, dismantled, status FROM cars"
+PROFITS_EXPORT_QUERY = "SELECT stockn, date, cumulative_amount, change_amount FROM profits"
+
+CARS_SCHEMA = pa.schema([
+    ("stockn", pa.int64()), ("make", pa.string()), ("model", pa.string()), ("year", pa.int64()),
+    ("cost", pa.float64()), ("inventoried", pa.date32()), ("dismantled", pa.date32()), ("status", pa.string()),
+])
+PROFITS_SCHEMA = pa.schema([
+    ("stockn", pa.int64()), ("date", pa.date32()),
+    ("cumulative_amount", pa.float64()), ("change_amount", pa.float64()),
+])
+
+# Исторические запросы. Текст общий для DuckDB и Postgres: в DuckDB cars и profits — представления над Parquet.
+# Итоги площадки по датам снимков хранятся в portfolio_daily (services.portfolio_service).
+MAKE_REVENUE_QUERY = """
+    SELECT p.date, c.make, COUNT(*) AS cars, SUM(p.change_amount) AS change_amount,
+           SUM(p.cumulative_amount) AS cumulative_amount
+    FROM profits p JOIN cars c ON c.stockn = p.stockn
+    WHERE p.date BETWEEN :date_from AND :date_to
+    GROUP BY p.date, c.make
+    ORDER BY p.date, c.make
+"""
+SNAPSHOT_COMPARISON_QUERY = """
+    SELECT COALESCE(a.stockn, b.stockn) AS stockn, a.cumulative_amount AS amount_before,
+           b.cumulative_amount AS amount_after,
+           COALESCE(b.cumulative_amount, 0) - COALESCE(a.cumulative_amount, 0) AS difference
+    FROM (SELECT stockn, cumulative_amount FROM profits WHERE date = :date_before) a
+    FULL OUTER JOIN (SELECT stockn, cumulative_amount FROM profits WHERE date = :date_after) b
+        ON a.stockn = b.stockn
+    ORDER BY difference DESC, stockn
+"""
+
+def analytics_available() -> bool:
+    """Доступен ли встроенный аналитический движок (установлен ли duckdb)."""
+    return duckdb is not None
+
+def _read_manifest() -> dict:
+    path = ANALYTICS_DIR / MANIFEST_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+def _write_manifest(version: int):
+    temporary = ANALYTICS_DIR / f"{MANIFEST_FILE}.tmp"
+    temporary.write_text(json.dumps({"version": version}))
+    os.replace(temporary, ANALYTICS_DIR / MANIFEST_FILE)
+
+def _export_query(connection, query: str, schema: pa.Schema, path: Path, params=None) -> int:
+    """Выгружает результат запроса в Parquet пакетами, файл подменяется целиком по окончании записи."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    rows = 0
+    with pq.ParquetWriter(temporary, schema) as writer:
+        for batch in pd.read_sql(text(query), connection, params=params, chunksize=EXPORT_BATCH_SIZE):
+            writer.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False))
+            rows += len(batch)
+    os.replace(temporary, path)
+    return rows
+
+def _profits_path(snapshot_date) -> Path:
+    return ANALYTICS_DIR / "profits" / f"{pd.Timestamp(snapshot_date):%Y-%m-%d}.parquet"
+
+def refresh_analytics(dates=None) -> bool:
+    """
+    Обновляет Parquet-выгрузку после изменения данных.
+    dates — даты снимков Profits, затронутые изменением (после импорта — его дата, пустой список —
+    только Cars). Инкрементальное обновление возможно, если выгрузка отставала ровно на это изменение;
+    иначе, как и при dates=None, выгрузка перестраивается целиком.
+    Ничего не делает, если duckdb не установлен. Возвращает True, если выгрузка обновлена.
+    """
+    if not analytics_available():
+        return False
+    try:
+        # Версия данных и выгружаемые строки читаются из одного снимка базы
+        with engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection:
+            with connection.begin():
+                version = get_data_version(Session(bind=connection))
+                incremental = dates is not None and _read_manifest().get("version") == version - 1
+
+                _export_query(connection, CARS_EXPORT_QUERY, CARS_SCHEMA, ANALYTICS_DIR / "cars.parquet")
+                if incremental:
+                    for snapshot_date in dates:
+                        _export_profits_date(connection, snapshot_date)
+                else:
+                    shutil.rmtree(ANALYTICS_DIR / "profits", ignore_errors=True)
+                    snapshot_dates = connection.execute(text("SELECT DISTINCT date FROM profits")).scalars().all()
+                    for snapshot_date in snapshot_dates:
+                        _export_profits_date(connection, snapshot_date)
+                _write_manifest(version)
+        logging.info(f"Аналитическая выгрузка обновлена до версии {version} ({'инкрементально' if incremental else 'полностью'}).")
+        return True
+    except Exception as e:
+        logging.error(f"Ошибка при обновлении аналитической выгрузки: {e}")
+        return False
+
+def _export_profits_date(connection, snapshot_date):
+    """Перевыгружает снимок Profits за одну дату; пустой снимок удаляет файл."""
+    path = _profits_path(snapshot_date)
+    rows = _export_query(connection, f"{PROFITS_EXPORT_QUERY} WHERE date = :date", PROFITS_SCHEMA, path,
+                         params={"date": snapshot_date})
+    if rows == 0:
+        path.unlink()
+
+def _is_fresh() -> bool:
+    """Выгрузка соответствует текущей версии данных в Postgres."""
+    with engine.connect() as connection:
+        return _read_manifest().get("version") == get_data_version(Session(bind=connection))
+
+def _run_duckdb(query: str, params: dict) -> pd.DataFrame:
+    connection = duckdb.connect()
+    try:
+        connection.execute(f"CREATE VIEW cars AS SELECT * FROM read_parquet('{ANALYTICS_DIR / 'cars.parquet'}')")
+        profit_files = sorted((ANALYTICS_DIR / "profits").glob("*.parquet"))
+        if profit_files:
+            connection.execute(f"CREATE VIEW profits AS SELECT * FROM read_parquet({[str(path) for path in profit_files]})")
+        else:
+            connection.execute("CREATE TABLE profits (stockn BIGINT, date DATE, cumulative_amount DOUBLE, change_amount DOUBLE)")
+        # Параметры :name в DuckDB записываются как $name
+        return connection.execute(re.sub(r":(\w+)", r"$\1", query), params).df()
+    finally:
+        connection.close()
+
+def run_history_query(query: str, params: dict = None) -> pd.DataFrame:
+    """
+    Выполняет исторический запрос в DuckDB по Parquet-выгрузке, если она актуальна,
+    иначе — в Postgres.
+    """
+    params = params or {}
+    if analytics_available() and _is_fresh():
+        try:
+            return _run_duckdb(query, params)
+        except Exception as e:
+            logging.error(f"Ошибка аналитического запроса в DuckDB, запрос выполнен в Postgres: {e}")
+    with engine.connect() as connection:
+        return pd.read_sql(text(query), connection, params=params)
+
+def get_make_revenue_history(date_from, date_to) -> pd.DataFrame:
+    """Прирост продаж по make за каждую дату снимка в интервале."""
+    return run_history_query(MAKE_REVENUE_QUERY, {"date_from": date_from, "date_to": date_to})
+
+def compare_snapshots(date_before, date_after) -> pd.DataFrame:
+    """Сравнение двух снимков по машинам: накопленная сумма до, после и разница."""
+    return run_history_query(SNAPSHOT_COMPARISON_QUERY, {"date_before": date_before, "date_after": date_after})
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    refresh_analytics()
@@ -1,7 +1,9 @@
 from datetime import date
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database.models import Cars, Profits
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from database.models import CarLatestState, Cars, Profits
+import numpy as np
 import pandas as pd
 
 # Функции расчета для одной машины
@@ -11,53 +13,74 @@ def calculate_age(inventoried_date):
 def calculate_payback(breakevendate, inventoried_date):
     return (breakevendate - inventoried_date).days if breakevendate and inventoried_date else None
 
-def calculate_profit(session, stockn, cost):
-    if cost is None or pd.isna(cost):
-        print(f"Cost is missing for stockn: {stockn}")
-        return None
+# Пакетный расчет profit и xs по последним записям Profits
+def get_latest_cumulative_amounts(session, stockns=None) -> dict:
+    """
+    Возвращает последний по дате cumulative_amount из Profits для каждого stockn
+    одним запросом к таблице car_latest_state.
 
-    last_cumulative_amount = (
-        session.query(Profits.cumulative_amount)
-        .filter(Profits.stockn == stockn)
-        .order_by(Profits.date.desc())
-        .first()
-    )
+    :param stockns: Набор stockn; None — все машины
+    :return: Словарь {stockn: cumulative_amount}
+    """
+    query = session.query(CarLatestState.stockn, CarLatestState.cumulative_amount)
+    if stockns is not None:
+        stockns = {int(stockn) for stockn in stockns}
+        if not stockns:
+            return {}
+        query = query.filter(CarLatestState.stockn.in_(stockns))
+    return dict(query.all())
 
-    if last_cumulative_amount is None or pd.isna(last_cumulative_amount[0]):
-        print(f"Cumulative amount is missing for stockn: {stockn}")
-        return None
+def calculate_profit_xs_batch(session, stockns, costs) -> pd.DataFrame:
+    """
+    Рассчитывает profit и xs сразу для многих машин по последнему cumulative_amount.
+    profit = int(cumulative_amount - cost), xs = round(cumulative_amount / cost, 2);
+    если cost или cumulative_amount отсутствуют, значения равны None.
 
-    profit = int(last_cumulative_amount[0] - cost)
-    print(f"Calculated profit for stockn {stockn}: {profit}")
-    return profit
+    :param stockns: Последовательность stockn
+    :param costs: Последовательность cost той же длины
+    :return: DataFrame со столбцами stockn, cost, cumulative_amount, profit, xs в порядке входных данных
+    """
+    result = pd.DataFrame({
+        "stockn": pd.Series(list(stockns), dtype='Int64'),
+        "cost": pd.to_numeric(pd.Series(list(costs), dtype=object), errors='coerce').astype('Float64'),
+    })
+    latest = pd.Series(get_latest_cumulative_amounts(session, result["stockn"].dropna()), dtype='Float64')
+    result["cumulative_amount"] = result["stockn"].map(latest).astype('Float64')
 
-def calculate_xs(session, stockn, cost):
-    if cost is None or pd.isna(cost):
-        print(f"Cost is missing for stockn: {stockn}")
-        return None
-
-    last_cumulative_amount = (
-        session.query(Profits.cumulative_amount)
-        .filter(Profits.stockn == stockn)
-        .order_by(Profits.date.desc())
-        .first()
-    )
+    known = result["cost"].notna() & result["cumulative_amount"].notna()
+    difference = result["cumulative_amount"] - result["cost"]
+    result["profit"] = np.trunc(difference.where(known)).astype('Int64')
+    result["xs"] = (result["cumulative_amount"] / result["cost"]).where(known & result["cost"].ne(0)).round(2)
+    return result
 
-    if last_cumulative_amount is None or pd.isna(last_cumulative_amount[0]):
-        print(f"Cumulative amount is missing for stockn: {stockn}")
-        return None
+def calculate_profit(session, stockn, cost):
+    """Прибыль одной машины; для многих машин используйте calculate_profit_xs_batch."""
+    profit = calculate_profit_xs_batch(session, [stockn], [cost]).loc[0, "profit"]
+    return None if pd.isna(profit) else int(profit)
 
-    xs = round(last_cumulative_amount[0] / cost, 2)
-    print(f"Calculated xs for stockn {stockn}: {xs}")
-    return xs
+def calculate_xs(session, stockn, cost):
+    """Иксы одной машины; для многих машин используйте calculate_profit_xs_batch."""
+    xs = calculate_profit_xs_batch(session, [stockn], [cost]).loc[0, "xs"]
+    return None if pd.isna(xs) else float(xs)
 
 # Агрегационные функции
+# Метрики, которые вычисляются в SQL при чтении вместо хранимых столбцов
+COMPUTED_METRICS = {
+    "age": Cars.current_age,
+    "payback": Cars.current_payback,
+}
+
+def get_metric_column(field):
+    """SQL-выражение метрики Cars: вычисляемое для age/payback, иначе столбец таблицы."""
+    return COMPUTED_METRICS.get(field, getattr(Cars, field))
+
 def get_min_max_avg_sum(session, field, make=None, model=None, status=["active"]):
+    column = get_metric_column(field)
     query = session.query(
-        func.min(getattr(Cars, field)),
-        func.max(getattr(Cars, field)),
-        func.avg(getattr(Cars, field)),
-        func.sum(getattr(Cars, field))
+        func.min(column),
+        func.max(column),
+        func.avg(column),
+        func.sum(column)
     ).filter(Cars.status.in_(status))
 
     if make:
@@ -67,19 +90,80 @@ def get_min_max_avg_sum(session, field, make=None, model=None, status=["active"]
 
     return query.first()
 
+# Метрики сводки и статистики, которые считаются одним запросом
+AGGREGATE_METRICS = ("age", "payback", "profit", "xs", "cost")
+AGGREGATE_STATS = ("min", "max", "avg", "sum")
+
+# Варианты группировки: наборы GROUPING SETS, итоговая строка () добавляется всегда
+AGGREGATE_GROUPINGS = {
+    "make": [("make",)],
+    "model": [("model",)],
+    "make_model": [("make", "model"), ("make",)],
+}
+
+def build_metric_aggregates_query(session, metrics=AGGREGATE_METRICS, group_by=None, make=None, model=None,
+                                  status=("active",)):
+    """
+    Запрос min/max/avg/sum всех метрик одним оператором.
+    Столбцы результата: <метрика>_<min|max|avg|sum>. При group_by ("make", "model", "make_model")
+    строки считаются через GROUPING SETS вместе с подытогами и общим итогом; столбец grouping —
+    битовая маска GROUPING(): 0 у детальных строк, ненулевая у подытогов и итога.
+    """
+    aggregates = []
+    for field in metrics:
+        column = get_metric_column(field)
+        aggregates += [
+            func.min(column).label(f"{field}_min"),
+            func.max(column).label(f"{field}_max"),
+            func.avg(column).label(f"{field}_avg"),
+            func.sum(column).label(f"{field}_sum"),
+        ]
+
+    group_columns = []
+    if group_by:
+        group_fields = list(AGGREGATE_GROUPINGS[group_by][0])
+        group_columns = [getattr(Cars, field) for field in group_fields]
+        grouping_sets = [tuple_(*[getattr(Cars, field) for field in fields])
+                         for fields in AGGREGATE_GROUPINGS[group_by]] + [tuple_()]
+        query = session.query(*group_columns, func.grouping(*group_columns).label("grouping"), *aggregates)
+    else:
+        query = session.query(*aggregates)
+
+    query = query.filter(Cars.status.in_(list(status)))
+    if make:
+        query = query.filter(Cars.make == make)
+    if model:
+        query = query.filter(Cars.model == model)
+
+    if group_by:
+        query = query.group_by(func.grouping_sets(*grouping_sets)).order_by(*group_columns)
+    return query
+
+def get_metric_aggregates(session, metrics=AGGREGATE_METRICS, group_by=None, make=None, model=None,
+                          status=("active",)) -> pd.DataFrame:
+    """Результат build_metric_aggregates_query в виде DataFrame: полная разбивка за один запрос."""
+    query = build_metric_aggregates_query(session, metrics, group_by, make, model, status)
+    return pd.DataFrame(query.all(), columns=[c["name"] for c in query.column_descriptions])
+
 # Пример агрегации для конкретных полей
 def get_aggregated_data(session, make=None, model=None, include_scrap=False):
     status_filter = ["active"]
     if include_scrap:
         status_filter.append("scrap")
 
+    # Один запрос вместо отдельного на каждую метрику
+    row = build_metric_aggregates_query(session, make=make, model=model, status=status_filter).one()._mapping
+
+    def stats(field):
+        return tuple(row[f"{field}_{stat}"] for stat in AGGREGATE_STATS)
+
     results = {
-        "age": get_min_max_avg_sum(session, "age", make, model, status_filter),
-        "payback": get_min_max_avg_sum(session, "payback", make, model, status_filter),
-        "profit": get_min_max_avg_sum(session, "profit", make, model, status_filter),
-        "xs": get_min_max_avg_sum(session, "xs", make, model, status_filter),
-        "cost_sum": get_min_max_avg_sum(session, "cost", make, model, status_filter)[3],
-        "profit_sum": get_min_max_avg_sum(session, "profit", make, model, status_filter)[3],
+        "age": stats("age"),
+        "payback": stats("payback"),
+        "profit": stats("profit"),
+        "xs": stats("xs"),
+        "cost_sum": row["cost_sum"],
+        "profit_sum": row["profit_sum"],
     }
     return results
 
@@ -118,6 +202,48 @@ def get_profit_dynamics(session, stockn):
 
     return formatted_changes
 
+def format_profit_dynamics(changes: pd.Series) -> pd.Series:
+    """Векторное форматирование изменений прибыли: ⬆️ (+N), ⬇️ (-N) или 0."""
+    changes = pd.to_numeric(changes, errors='coerce').fillna(0)
+    amounts = np.trunc(changes).astype('int64').astype(str)
+    return pd.Series(
+        np.select(
+            [changes > 0, changes < 0],
+            ["⬆️ (+" + amounts + ")", "⬇️ (" + amounts + ")"],
+            default="0",
+        ),
+        index=changes.index,
+    )
+
+def get_profit_dynamics_batch(session, stockns, last_n=None) -> pd.Series:
+    """
+    Динамика прибыли сразу для многих машин одним запросом: история change_amount
+    по каждому stockn собирается в массив (array_agg, от новых к старым).
+
+    :param stockns: Набор stockn
+    :param last_n: Сколько последних изменений оставить; None — вся история
+    :return: Series {stockn: "⬆️ (+N) / ⬇️ (-N) / 0"}; машины без истории отсутствуют
+    """
+    stockns = {int(stockn) for stockn in pd.Series(stockns).dropna()}
+    if not stockns:
+        return pd.Series(dtype=object)
+
+    history = func.array_agg(aggregate_order_by(Profits.change_amount, Profits.date.desc()))
+    if last_n:
+        history = history[1:last_n]
+    rows = (
+        session.query(Profits.stockn, history)
+        .filter(Profits.stockn.in_(stockns))
+        .group_by(Profits.stockn)
+        .all()
+    )
+    if not rows:
+        return pd.Series(dtype=object)
+
+    changes = pd.DataFrame(rows, columns=["stockn", "changes"]).explode("changes")
+    changes["formatted"] = format_profit_dynamics(changes["changes"])
+    return changes.groupby("stockn", sort=False)["formatted"].agg(" / ".join)
+
 def calculate_change_amount(session, profit_id, stockn, new_cumulative_amount, new_date):
     previous_profit = (
         session.query(Profits.cumulative_amount)
@@ -130,3 +256,51 @@ def calculate_change_amount(session, profit_id, stockn, new_cumulative_amount, n
         return new_cumulative_amount - previous_profit[0]
     else:
         return new_cumulative_amount
+
+def recompute_change_amounts(session: Session, stockns=None, from_date=None) -> list:
+    """
+    Пересчитывает change_amount по всей истории машин одним UPDATE ... FROM с окном
+    LAG(cumulative_amount) OVER (PARTITION BY stockn ORDER BY date): разница с предыдущим
+    по дате снимком с известным cumulative_amount, а не с последним импортированным. Нужен, когда снимок загружен задним числом
+    или удален из середины истории. Переписываются только строки, где значение изменилось
+    (IS DISTINCT FROM). Фиксацию транзакции выполняет вызывающий код; car_latest_state
+    после пересчета нужно обновить.
+
+    :param stockns: Набор stockn; None — вся таблица
+    :param from_date: Пересчитывать строки с этой даты и позже (предыдущие снимки читаются для LAG)
+    :return: Отсортированный список дат снимков, в которых изменился change_amount
+    """
+    # Окно разделено еще и по признаку пустого cumulative_amount: LAG строк с суммой видит только
+    # предыдущие строки с суммой, и снимок после пропуска считается от последнего известного значения.
+    # Как и при импорте: без cumulative_amount change_amount равен 0, первая запись считается от нуля
+    previous = func.lag(Profits.cumulative_amount).over(
+        partition_by=(Profits.stockn, Profits.cumulative_amount.is_(None)), order_by=Profits.date,
+    )
+    recomputed = select(
+        Profits.id,
+        case((Profits.cumulative_amount.is_(None), 0.0),
+             else_=Profits.cumulative_amount - func.coalesce(previous, 0.0)).label("change_amount"),
+    )
+    if stockns is not None:
+        stockns = {int(stockn) for stockn in stockns if stockn is not None}
+        if not stockns:
+            return []
+        recomputed = recomputed.where(Profits.stockn.in_(stockns))
+    if from_date is not None:
+        # Окно считается только по машинам, у которых есть снимки с from_date
+        later = select(Profits.stockn).where(Profits.date >= from_date)
+        if stockns is not None:
+            later = later.where(Profits.stockn.in_(stockns))
+        recomputed = recomputed.where(Profits.stockn.in_(later))
+    source = recomputed.subquery()
+
+    statement = (
+        update(Profits)
+        .where(Profits.id == source.c.id, Profits.change_amount.is_distinct_from(source.c.change_amount))
+        .values(change_amount=source.c.change_amount)
+        .returning(Profits.date)
+        .execution_options(synchronize_session=False)
+    )
+    if from_date is not None:
+        statement = statement.where(Profits.date >= from_date)
+    return sorted(set(session.execute(statement).scalars().all()))
@@ -1,68 +1,103 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database.models import Cars, Profits
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from database.models import CarLatestState, Cars, Imports, Profits
 from database.db import SessionLocal
-from services.calculate import calculate_profit, calculate_xs, calculate_payback
+from services.calculate import recompute_change_amounts
+from services.latest_state_service import refresh_latest_state
+from services.table_service import bump_data_version
+from services.analytics_service import refresh_analytics
+from services.portfolio_service import refresh_portfolio_daily
 
-def get_all_import_ids() -> list:
+# Строк, удаляемых одним запросом при удалении импорта
+DELETE_BATCH_SIZE = 10000
+
+def get_imports() -> list:
     """
-    Возвращает список всех уникальных import_id из таблиц Cars и Profits.
+    Список импортов из реестра imports, новые первыми: одна строка на импорт,
+    без DISTINCT по Cars и Profits.
 
-    :return: Список уникальных import_id
+    :return: Список записей Imports
     """
     session: Session = SessionLocal()
 
     try:
-        # Получаем уникальные import_id из всех таблиц
-        cars_import_ids = session.query(Cars.import_id).distinct().all()
-        profits_import_ids = session.query(Profits.import_id).distinct().all()
-
-        # Объединяем результаты в один список и удаляем дубликаты
-        all_import_ids = set(
-            [id[0] for id in cars_import_ids] +
-            [id[0] for id in profits_import_ids]
-        )
-
-        return sorted(list(all_import_ids))
+        imports = session.query(Imports).order_by(Imports.id.desc()).all()
+        session.expunge_all()
+        return imports
 
     except Exception as e:
-        print(f"Ошибка при получении import_id: {e}")
+        print(f"Ошибка при получении списка импортов: {e}")
         return []
 
     finally:
         session.close()
 
-def delete_data_by_import_id(import_id: str) -> dict:
+def get_all_import_ids() -> list:
     """
-    Удаляет все данные, связанные с заданным import_id, из таблиц Cars и Profits.
-    Если удаляемый import_id является последним, пересчитывает значения в Cars.
+    Возвращает список всех уникальных import_id из реестра импортов.
 
-    :param import_id: Идентификатор импорта
+    :return: Список уникальных import_id
+    """
+    return sorted({record.import_id for record in get_imports()})
+
+def _delete_in_batches(session: Session, model, import_ref: int, *returning) -> list:
+    """
+    Удаляет строки таблицы с заданным import_ref порциями по DELETE_BATCH_SIZE
+    (поиск по индексу ix_<таблица>_import_ref) и возвращает значения столбцов returning удаленных строк.
+    """
+    deleted = []
+    batch = select(model.id).where(model.import_ref == import_ref).limit(DELETE_BATCH_SIZE).scalar_subquery()
+    while True:
+        rows = session.execute(
+            delete(model)
+            .where(model.import_ref == import_ref, model.id.in_(batch))
+            .returning(*returning)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not rows:
+            return deleted
+        deleted += rows
+
+def delete_import(import_ref: int) -> dict:
+    """
+    Удаляет импорт по id записи реестра: строки Cars и Profits с этим import_ref удаляются порциями,
+    затем в той же транзакции пересчитываются change_amount следующих снимков, profit, xs и payback в Cars
+    только для stockn, затронутых удаляемым импортом, и удаляется запись реестра.
+
+    :param import_ref: id записи в таблице imports
     :return: Словарь с количеством удалённых строк из каждой таблицы
     """
     session: Session = SessionLocal()
 
     try:
-        # Определяем, является ли удаляемый import_id последним
-        latest_import_id = session.query(Profits.import_id).order_by(Profits.date.desc()).first()
-        is_latest_import = (latest_import_id and latest_import_id[0] == import_id)
-
-        # Удаляем записи из таблицы Cars
-        deleted_cars = session.query(Cars).filter(Cars.import_id == import_id).delete()
-
-        # Удаляем записи из таблицы Profits
-        deleted_profits = session.query(Profits).filter(Profits.import_id == import_id).delete()
+        deleted_profits = _delete_in_batches(session, Profits, import_ref, Profits.stockn, Profits.date)
+        deleted_cars = _delete_in_batches(session, Cars, import_ref, Cars.stockn)
+        session.query(Imports).filter(Imports.id == import_ref).delete(synchronize_session=False)
+
+        # stockn, у которых после удаления может измениться последняя запись Profits
+        affected_stockns = {row.stockn for row in deleted_profits} | {row.stockn for row in deleted_cars}
+        deleted_dates = {row.date for row in deleted_profits}
+
+        # Пересчитываем change_amount, последнее состояние и значения в таблице Cars для затронутых stockn.
+        # Снимки после самой ранней удаленной даты будут считаться от других предыдущих снимков
+        recomputed_dates = []
+        if deleted_dates:
+            recomputed_dates = recompute_change_amounts(session, affected_stockns, min(deleted_dates))
+        refresh_latest_state(session, affected_stockns)
+        recalculate_cars_data(session, affected_stockns)
+        # Итоги площадки: удаленные даты, даты с пересчитанным change_amount и снимки удаленных машин
+        refresh_portfolio_daily(session, deleted_dates | set(recomputed_dates), {row.stockn for row in deleted_cars})
 
         # Применяем изменения
+        bump_data_version(session)
         session.commit()
 
-        # Если удалён последний импорт, пересчитываем значения в таблице Cars
-        if is_latest_import:
-            recalculate_cars_data(session)
+        # Аналитическая выгрузка: снимки удаленных дат и дат с пересчитанным change_amount
+        refresh_analytics(sorted(deleted_dates | set(recomputed_dates)))
 
         return {
-            "cars_deleted": deleted_cars,
-            "profits_deleted": deleted_profits
+            "cars_deleted": len(deleted_cars),
+            "profits_deleted": len(deleted_profits)
         }
 
     except Exception as e:
@@ -72,14 +107,61 @@ def delete_data_by_import_id(import_id: str) -> dict:
     finally:
         session.close()
 
-def recalculate_cars_data(session: Session):
+def delete_data_by_import_id(import_id: str) -> dict:
+    """
+    Удаляет все импорты с заданным import_id (см. delete_import).
+
+    :param import_id: Идентификатор импорта
+    :return: Словарь с количеством удалённых строк из каждой таблицы
+    """
+    result = {"cars_deleted": 0, "profits_deleted": 0}
+    for record in get_imports():
+        if record.import_id == import_id:
+            deleted = delete_import(record.id)
+            result = {key: result[key] + deleted[key] for key in result}
+    return result
+
+def _is_known(column):
+    """Условие "значение задано": не NULL и не NaN."""
+    return and_(column.isnot(None), column != float('nan'))
+
+def recalculate_cars_data(session: Session, stockns=None) -> int:
     """
-    Пересчитывает значения profit, xs и payback в таблице Cars на основе оставшихся данных в Profits.
+    Пересчитывает значения profit, xs и payback в таблице Cars на основе оставшихся данных в Profits
+    одним UPDATE ... FROM по таблице car_latest_state, которая должна быть уже обновлена.
+    Фиксацию транзакции выполняет вызывающий код.
+
+    :param stockns: Набор stockn для пересчета; None — все машины
+    :return: Количество обновлённых (изменившихся) строк Cars
     """
-    cars = session.query(Cars).all()
-    for car in cars:
-        # Рассчитываем значения на основе оставшихся записей в Profits
-        car.profit = calculate_profit(session, car.stockn, car.cost) if car.cost else None
-        car.xs = calculate_xs(session, car.stockn, car.cost) if car.cost else None
-        car.payback = calculate_payback(car.breakevendate, car.inventoried) if car.inventoried and car.breakevendate else None
-    session.commit()
+    # LEFT JOIN: у машин без оставшихся записей Profits profit и xs обнуляются
+    cars = (
+        select(Cars.id, CarLatestState.cumulative_amount)
+        .select_from(Cars)
+        .outerjoin(CarLatestState, CarLatestState.stockn == Cars.stockn)
+    )
+    if stockns is not None:
+        stockns = {int(stockn) for stockn in stockns if stockn is not None}
+        if not stockns:
+            return 0
+        cars = cars.where(Cars.stockn.in_(stockns))
+    source = cars.subquery()
+    cumulative_amount = source.c.cumulative_amount
+    # Те же правила, что в calculate_profit_xs_batch при импорте: profit при известных cost и
+    # cumulative_amount, xs еще и при ненулевом cost. round(float8) округляет половину к четному,
+    # как pandas .round(2), поэтому xs совпадает с импортом (numeric round округлял бы от нуля)
+    has_values = and_(_is_known(Cars.cost), _is_known(cumulative_amount))
+    profit = case((has_values, func.trunc(cumulative_amount - Cars.cost)), else_=None)
+    xs = case((and_(has_values, Cars.cost != 0), func.round(cumulative_amount / Cars.cost * 100) / 100), else_=None)
+    payback = Cars.breakevendate - Cars.inventoried
+
+    statement = (
+        update(Cars)
+        .where(Cars.id == source.c.id)
+        # Строки, где значения не меняются, не перезаписываются
+        .where(or_(Cars.profit.is_distinct_from(profit), Cars.xs.is_distinct_from(xs),
+                   Cars.payback.is_distinct_from(payback)))
+        .values(profit=profit, xs=xs, payback=payback)
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(statement).rowcount
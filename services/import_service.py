@@ -1,198 +1,730 @@
 import pandas as pd
-import re
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from database.models import Cars, Profits
-from database.db import SessionLocal
-from datetime import datetime
-from services.calculate import calculate_age, calculate_payback, calculate_profit, calculate_xs
+from database.models import Cars, Imports, Profits
+from database.db import SessionLocal, count_queries
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from services.calculate import calculate_profit_xs_batch, recompute_change_amounts
+from services.latest_state_service import refresh_latest_state
+from services.partition_service import ensure_profit_partitions
+from services.table_service import bump_data_version
+from services.analytics_service import refresh_analytics
+from services.portfolio_service import refresh_portfolio_daily
+from services.delete_service import recalculate_cars_data
+import hashlib
 import logging
+import os
+import time
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-def clean_milage(milage_value: str) -> str:
-    """Удаляет все нецифровые символы из пробега."""
-    return re.sub(r'\D', '', milage_value) if milage_value else None
+# Поля Cars, которые обновляются у существующих машин (правило "новое значение или старое")
+FULL_UPDATE_FIELDS = [
+    "make", "model", "year", "color", "milage", "engine",
+    "cost", "inventoried", "breakevendate", "dismantled",
+]
+COLOR_UPDATE_FIELDS = ["color", "milage", "engine"]
 
-def calculate_change_amount_for_import(session, stockn, new_import_date, new_cumulative_amount, import_id):
+# Отпечаток строки Cars (content_hash) считается по всем полям выгрузки с приведением к общим типам:
+# одно и то же значение из файла и из базы дает один и тот же хеш
+HASH_NUMERIC_FIELDS = ("year", "milage", "cost")
+HASH_DATE_FIELDS = ("inventoried", "breakevendate", "dismantled")
+
+# Количество строк файла, обрабатываемых за один проход очистки и записи
+IMPORT_CHUNK_SIZE = 5000
+
+# Этапы импорта, для которых замеряется время (секунды суммируются по всем блокам)
+IMPORT_STAGES = ("parse", "normalize", "cars_upsert", "profits_insert", "profit_xs", "portfolio", "commit")
+
+# Текстовые столбцы выгрузки читаются из CSV как строки: иначе каждый блок pd.read_csv выводит тип сам,
+# и, например, xcoord 3 в блоке с пропусками становится 3.0 и дает другой location
+CSV_TEXT_COLUMNS = ("manufacturer", "modelname", "Color", "Odo Reading", "Engine", "bin", "xcoord")
+
+# Строки, которые pd.read_excel по умолчанию считает пустыми; потоковое чтение Excel ведет себя так же
+EXCEL_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+@contextmanager
+def _stage_timer(timings: dict, stage: str):
+    """Добавляет время выполнения блока with к timings[stage]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def _is_filled(series: pd.Series) -> pd.Series:
+    """Маска непустых значений с семантикой `value or old`: None, NaN, '' и 0 считаются пустыми."""
+    filled = series.notna()
+    values = series.astype(object).where(filled, None)
+    return filled & values.ne('') & values.ne(0)
+
+def _to_records(frame: pd.DataFrame) -> list:
+    """Преобразует DataFrame в список словарей, заменяя NaN/NaT на None."""
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), None).to_dict(orient='records')
+
+def _status(dismantled: pd.Series) -> pd.Series:
+    """Статус машины: 'scrap', если указана дата разборки, иначе 'active'."""
+    return _is_filled(dismantled).map({True: 'scrap', False: 'active'})
+
+def _text_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Текстовый столбец файла в виде nullable string; отсутствующий столбец — пустой."""
+    if column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype='string')
+    return df[column].astype('string')
+
+def _numeric_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Числовой столбец файла; нечисловые значения превращаются в NA."""
+    if column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype='Float64')
+    return pd.to_numeric(df[column], errors='coerce').astype('Float64')
+
+def _date_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Столбец дат файла в виде datetime64; некорректные значения превращаются в NaT."""
+    if column not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    return pd.to_datetime(df[column], errors='coerce')
+
+def _as_date(series: pd.Series) -> pd.Series:
+    """datetime64 -> объекты date с None вместо NaT для записи в столбцы Date."""
+    return series.dt.date.astype(object).where(series.notna(), None)
+
+def _clean_milage(df: pd.DataFrame) -> pd.Series:
+    """Пробег из столбца 'Odo Reading': числа берутся как есть, из строк удаляются все нецифровые символы."""
+    if 'Odo Reading' not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype='Float64')
+    raw = df['Odo Reading']
+    numeric = pd.to_numeric(raw, errors='coerce')
+    digits = raw.astype('string').str.replace(r'\D', '', regex=True).replace('', pd.NA)
+    return numeric.astype('Float64').fillna(pd.to_numeric(digits, errors='coerce').astype('Float64'))
+
+def _create_location(df: pd.DataFrame) -> pd.Series:
+    """Строка location на основе bin и xcoord: 'bin.xcoord', либо то из двух, что заполнено."""
+    bin_value = _text_column(df, 'bin').fillna('')
+    xcoord_value = _text_column(df, 'xcoord').fillna('')
+    both = (bin_value != '') & (xcoord_value != '')
+    return (bin_value + '.' + xcoord_value).where(both, bin_value + xcoord_value)
+
+def normalize_import_frame(df: pd.DataFrame, color_mileage_engine: bool) -> pd.DataFrame:
     """
-    Рассчитывает и добавляет новую запись в таблицу Profits для заданного stockn и даты импорта.
-    Если запись уже существует для stockn и даты, она не будет обновляться.
-    Если cumulative_amount отсутствует, change_amount устанавливается в 0.
+    Приводит блок строк файла к типизированным колонкам таблицы Cars целиком по столбцам:
+    очищает пробег, собирает location, разбирает даты, считает age и payback
+    и отбрасывает stockn < 10400.
+    Повторяющиеся stockn схлопываются, побеждает последняя строка файла.
     """
-    from sqlalchemy import func
+    stock_column = 'Stock #' if color_mileage_engine else 'vstockno'
+    frame = pd.DataFrame({
+        "stockn": _numeric_column(df, stock_column).round().astype('Int64'),
+        "color": _text_column(df, 'Color'),
+        "milage": _clean_milage(df),
+        "engine": _text_column(df, 'Engine'),
+    }, index=df.index)
+    if not color_mileage_engine:
+        inventoried = _date_column(df, 'inventoried')
+        breakevendate = _date_column(df, 'breakevendate')
+        frame["make"] = _text_column(df, 'manufacturer')
+        frame["model"] = _text_column(df, 'modelname')
+        frame["year"] = _numeric_column(df, 'modelyear').round().astype('Int64')
+        frame["location"] = _create_location(df)
+        frame["cost"] = _numeric_column(df, 'cost')
+        frame["inventoried"] = _as_date(inventoried)
+        frame["breakevendate"] = _as_date(breakevendate)
+        frame["dismantled"] = _as_date(_date_column(df, 'dismantled'))
+        frame["age"] = (pd.Timestamp(date.today()) - inventoried).dt.days.astype('Int64')
+        frame["payback"] = (breakevendate - inventoried).dt.days.astype('Int64')
+        frame["sales"] = _numeric_column(df, 'sales')
 
-    # Проверяем, существует ли запись для данного stockn и даты
-    existing_record = (
-        session.query(Profits)
-        .filter(
-            Profits.stockn == stockn,
-            func.date(Profits.date) == new_import_date
-        )
-        .first()
+    keep = frame["stockn"].ge(10400).fillna(False)
+    skipped = int((~keep).sum())
+    if skipped:
+        logging.debug(f"Пропущено {skipped} строк со stockn меньше 10400.")
+    return frame[keep].drop_duplicates(subset="stockn", keep="last")
+
+def _load_existing_cars(session: Session, stockns: list) -> pd.DataFrame:
+    """
+    Загружает существующие машины для всех stockn файла одним запросом.
+    Сохраненные отпечаток, profit и xs возвращаются как stored_hash, stored_profit, stored_xs.
+    """
+    columns = ["id", "stockn"] + FULL_UPDATE_FIELDS
+    stored = {"stored_hash": Cars.content_hash, "stored_profit": Cars.profit, "stored_xs": Cars.xs}
+    rows = session.execute(
+        select(*[getattr(Cars, column) for column in columns], *stored.values())
+        .where(Cars.stockn.in_(stockns))
+        .order_by(Cars.id)
+    ).all()
+    existing = pd.DataFrame(rows, columns=columns + list(stored))
+    existing["stockn"] = existing["stockn"].astype('Int64')
+    # Отпечаток строится из исходных int, а не из столбца DataFrame: при пустых значениях pandas
+    # приводит его к float64, и 64-битный хеш теряет точность
+    existing["stored_hash"] = pd.array([row[len(columns)] for row in rows], dtype='Int64')
+    return existing.drop_duplicates(subset="stockn", keep="first")
+
+def _insert_profits(session: Session, frame: pd.DataFrame, import_date, record: Imports) -> int:
+    """
+    Добавляет записи Profits за дату импорта одним INSERT ... ON CONFLICT DO NOTHING.
+    Уже существующие записи для stockn и даты не обновляются.
+    Если cumulative_amount отсутствует, change_amount устанавливается в 0; иначе change_amount
+    считается от последнего предыдущего снимка с известным cumulative_amount (или от нуля).
+    """
+    stockns = frame["stockn"].tolist()
+    previous = (
+        select(Profits.stockn, Profits.cumulative_amount)
+        .where(Profits.stockn.in_(stockns), Profits.date < import_date, Profits.cumulative_amount.isnot(None))
+        .distinct(Profits.stockn)
+        .order_by(Profits.stockn, Profits.date.desc())
     )
+    previous_amounts = pd.Series(dict(session.execute(previous).all()), dtype=float)
 
-    if existing_record:
-        logging.info(f"Запись уже существует для stockn {stockn} на дату {new_import_date}. Пропускаем.")
-        return False  # Новая запись не добавлена
+    cumulative = pd.to_numeric(frame["sales"], errors='coerce')
+    previous_cumulative = frame["stockn"].map(previous_amounts).fillna(0)
+    change_amount = (cumulative - previous_cumulative).where(cumulative.notna(), 0)
 
-    # Рассчитываем change_amount
-    if new_cumulative_amount is None:
-        change_amount = 0
-    else:
-        # Находим предыдущий cumulative_amount для данного stockn
-        previous_profit = (
-            session.query(Profits.cumulative_amount)
-            .filter(
-                Profits.stockn == stockn,
-                Profits.date < new_import_date
-            )
-            .order_by(Profits.date.desc())
-            .first()
-        )
-        if previous_profit:
-            previous_cumulative_amount = previous_profit[0]
-            change_amount = new_cumulative_amount - previous_cumulative_amount
+    rows = _to_records(pd.DataFrame({
+        "stockn": frame["stockn"],
+        "date": import_date,
+        "cumulative_amount": cumulative,
+        "change_amount": change_amount,
+        "import_id": record.import_id,
+        "import_ref": record.id,
+    }))
+    if not rows:
+        return 0
+
+    statement = (
+        pg_insert(Profits.__table__)
+        .on_conflict_do_nothing(index_elements=["stockn", "date"])
+        .returning(Profits.__table__.c.id)
+    )
+    return len(session.execute(statement, rows).all())
+
+def _merge_cars(frame: pd.DataFrame, existing: pd.DataFrame, color_mileage_engine: bool):
+    """
+    Объединяет строки файла с существующими машинами в памяти.
+    Для существующих машин пустое новое значение не затирает старое.
+    Возвращает (новые машины, обновлённые машины).
+    """
+    merged = frame.merge(existing, on="stockn", how="left", suffixes=("", "_old"))
+    is_new = merged["id"].isna()
+    fields = COLOR_UPDATE_FIELDS if color_mileage_engine else FULL_UPDATE_FIELDS
+
+    updated = merged[~is_new].copy()
+    for field in fields:
+        updated[field] = updated[field].astype(object).where(_is_filled(updated[field]), updated[f"{field}_old"])
+
+    new = merged[is_new].copy()
+    if not color_mileage_engine:
+        updated["status"] = _status(updated["dismantled"])
+        new["status"] = _status(new["dismantled"])
+    return new, updated
+
+def content_hash(cars: pd.DataFrame) -> pd.Series:
+    """
+    Отпечаток содержимого машин по полям выгрузки (FULL_UPDATE_FIELDS) для хранения в Cars.content_hash:
+    64-битный хеш pandas по значениям, приведенным к float, datetime64 и строкам.
+    """
+    canonical = pd.DataFrame(index=cars.index)
+    for field in FULL_UPDATE_FIELDS:
+        values = cars[field] if field in cars.columns else pd.Series(None, index=cars.index, dtype=object)
+        if field in HASH_NUMERIC_FIELDS:
+            canonical[field] = pd.to_numeric(values, errors='coerce').astype(float)
+        elif field in HASH_DATE_FIELDS:
+            canonical[field] = pd.to_datetime(values, errors='coerce')
         else:
-            change_amount = new_cumulative_amount
-
-    # Создаем новую запись и устанавливаем import_id
-    new_profit = Profits(
-        stockn=stockn,
-        date=new_import_date,
-        cumulative_amount=new_cumulative_amount,
-        change_amount=change_amount,
-        import_id=import_id  # Устанавливаем import_id
+            canonical[field] = values.astype(object).where(values.notna(), None)
+    return pd.Series(pd.util.hash_pandas_object(canonical, index=False).to_numpy().view('int64'), index=cars.index)
+
+def _same_values(left: pd.Series, right: pd.Series) -> pd.Series:
+    """Поэлементное равенство числовых значений, где два пустых значения тоже равны."""
+    left = pd.to_numeric(left, errors='coerce').astype(float)
+    right = pd.to_numeric(right, errors='coerce').astype(float)
+    return (left == right) | (left.isna() & right.isna())
+
+def _skip_unchanged(cars: pd.DataFrame, compare_columns=()) -> tuple:
+    """
+    Отбрасывает существующие машины, у которых отпечаток совпал с сохраненным и не изменились
+    compare_columns (profit, xs): такие строки не перезаписываются.
+    Возвращает (машины для записи, cars_added, cars_updated, cars_unchanged).
+    """
+    is_new = cars["id"].isna()
+    unchanged = ~is_new & cars["content_hash"].eq(cars["stored_hash"]).fillna(False)
+    for column in compare_columns:
+        unchanged &= _same_values(cars[column], cars[f"stored_{column}"])
+    return cars[~unchanged], int(is_new.sum()), int((~is_new & ~unchanged).sum()), int(unchanged.sum())
+
+def _upsert_cars(session: Session, cars: pd.DataFrame, update_columns: list):
+    """
+    Записывает машины одним INSERT ... ON CONFLICT (stockn) DO UPDATE.
+    Новые машины вставляются всеми столбцами, у существующих обновляются только update_columns
+    (их значения уже объединены со старыми в памяти).
+    """
+    if cars.empty:
+        return
+    statement = pg_insert(Cars.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["stockn"],
+        set_={column: statement.excluded[column] for column in update_columns},
+    )
+    session.execute(statement, _to_records(cars))
+
+def _prepare_cars(session: Session, frame: pd.DataFrame, record: Imports, color_mileage_engine: bool) -> tuple:
+    """
+    Объединяет нормализованный блок с существующими машинами и считает отпечатки итоговых строк.
+    Возвращает (cars, insert_columns, update_columns) для _skip_unchanged и _upsert_cars.
+    """
+    existing = _load_existing_cars(session, frame["stockn"].tolist())
+    new_cars, updated_cars = _merge_cars(frame, existing, color_mileage_engine)
+
+    update_columns = (COLOR_UPDATE_FIELDS if color_mileage_engine else FULL_UPDATE_FIELDS + ["status"]) + ["content_hash"]
+    insert_columns = ["stockn", "import_id", "import_ref", "content_hash"] + (COLOR_UPDATE_FIELDS if color_mileage_engine else FULL_UPDATE_FIELDS + ["location", "status", "age", "payback"])
+    cars = pd.concat([cars for cars in (new_cars, updated_cars) if not cars.empty], ignore_index=True)
+    cars["import_id"] = record.import_id
+    cars["import_ref"] = record.id
+    cars["content_hash"] = content_hash(cars)
+    return cars, insert_columns, update_columns
+
+def _changed_stockns(cars: pd.DataFrame) -> list:
+    """
+    stockn машин, прежние снимки которых в portfolio_daily устарели: существующие машины с измененными
+    make, cost или dismantled и новые машины (у них могут быть снимки, оставшиеся от удаленной строки Cars).
+    Снимок за дату импорта пересчитывается и без них.
+    """
+    changed = cars["id"].isna() | ~_same_values(cars["cost"], cars["cost_old"])
+    changed |= cars["make"].fillna("").ne(cars["make_old"].fillna(""))
+    dismantled, dismantled_old = pd.to_datetime(cars["dismantled"]), pd.to_datetime(cars["dismantled_old"])
+    changed |= dismantled.ne(dismantled_old) & ~(dismantled.isna() & dismantled_old.isna())
+    return cars.loc[changed, "stockn"].dropna().astype(int).tolist()
+
+def _import_chunk(session: Session, df: pd.DataFrame, selected_date, record: Imports, color_mileage_engine: bool,
+                  timings: dict, recomputed_dates: set, changed_stockns: set) -> tuple:
+    """
+    Проводит один блок строк файла через очистку и пакетную запись в Cars и Profits.
+    Время этапов добавляется в timings, даты более поздних снимков с пересчитанным change_amount —
+    в recomputed_dates, машины с измененными make, cost или dismantled — в changed_stockns.
+    Машины без изменений не перезаписываются.
+    Возвращает (cars_added, cars_updated, cars_unchanged, profits_added) для блока.
+    """
+    with _stage_timer(timings, "normalize"):
+        frame = normalize_import_frame(df, color_mileage_engine)
+        if frame.empty:
+            return 0, 0, 0, 0
+        cars, insert_columns, update_columns = _prepare_cars(session, frame, record, color_mileage_engine)
+    profits_added = 0
+    compare_columns = ()
+
+    # Обработка данных для Profits (только если color_mileage_engine=False)
+    if not color_mileage_engine:
+        with _stage_timer(timings, "profits_insert"):
+            profits_added = _insert_profits(session, frame, selected_date, record)
+            # Снимок задним числом меняет change_amount следующих снимков; строки за дату импорта уже посчитаны
+            recomputed_dates.update(recompute_change_amounts(session, frame["stockn"].tolist(),
+                                                             selected_date + timedelta(days=1)))
+            refresh_latest_state(session, frame["stockn"].tolist())
+
+        # Рассчитываем profit и xs для всех машин блока одним запросом
+        with _stage_timer(timings, "profit_xs"):
+            calculated = calculate_profit_xs_batch(session, cars["stockn"], cars["cost"])
+            cars["profit"] = calculated["profit"].to_numpy()
+            cars["xs"] = calculated["xs"].to_numpy()
+        insert_columns += ["profit", "xs"]
+        update_columns += ["profit", "xs"]
+        compare_columns = ("profit", "xs")
+
+    with _stage_timer(timings, "cars_upsert"):
+        cars, cars_added, cars_updated, cars_unchanged = _skip_unchanged(cars, compare_columns)
+        _upsert_cars(session, cars[insert_columns], update_columns)
+        if not color_mileage_engine:  # Цвет, пробег и двигатель в portfolio_daily не входят
+            changed_stockns.update(_changed_stockns(cars))
+    return cars_added, cars_updated, cars_unchanged, profits_added
+
+def _compute_change_amounts(session: Session, profits: pd.DataFrame) -> pd.DataFrame:
+    """
+    Считает change_amount для снимков пакета одним проходом groupby(stockn) + shift.
+    Вместе со снимками пакета сортируются уже сохраненные записи этих stockn: последняя до первой даты
+    пакета с известным cumulative_amount (начальное значение) и записи внутри интервала дат пакета. Поэтому результат совпадает
+    с последовательным импортом файлов по датам. Сохраненные записи имеют приоритет над строками
+    пакета на ту же дату; возвращаются только новые строки пакета.
+    """
+    stockns = profits["stockn"].dropna().astype(int).unique().tolist()
+    first_date, last_date = profits["date"].min(), profits["date"].max()
+    columns = [Profits.stockn, Profits.date, Profits.cumulative_amount]
+    seed = session.execute(
+        select(*columns)
+        .where(Profits.stockn.in_(stockns), Profits.date < first_date, Profits.cumulative_amount.isnot(None))
+        .distinct(Profits.stockn)
+        .order_by(Profits.stockn, Profits.date.desc())
+    ).all()
+    in_range = session.execute(
+        select(*columns).where(Profits.stockn.in_(stockns), Profits.date.between(first_date, last_date))
+    ).all()
+    stored = pd.DataFrame(seed + in_range, columns=["stockn", "date", "cumulative_amount"])
+    stored["stored"] = True
+
+    combined = pd.concat([frame for frame in (stored, profits.assign(stored=False)) if not frame.empty],
+                         ignore_index=True)
+    combined["stockn"] = combined["stockn"].astype('Int64')
+    combined["cumulative_amount"] = pd.to_numeric(combined["cumulative_amount"], errors='coerce')
+    combined = combined.drop_duplicates(subset=["stockn", "date"], keep="first").sort_values(["stockn", "date"])
+
+    # Снимок после пропуска cumulative_amount считается от последнего известного значения, как в recompute_change_amounts
+    cumulative = combined["cumulative_amount"]
+    previous = cumulative.groupby([combined["stockn"], cumulative.isna()]).shift().fillna(0)
+    combined["change_amount"] = (cumulative - previous).where(cumulative.notna(), 0)
+    return combined[~combined["stored"]].drop(columns="stored")
+
+def _insert_profit_history(session: Session, profits: pd.DataFrame, record: Imports) -> int:
+    """Записывает снимки пакета одним INSERT ... ON CONFLICT DO NOTHING; возвращает число вставленных строк."""
+    rows = _to_records(profits[["stockn", "date", "cumulative_amount", "change_amount"]].assign(
+        import_id=record.import_id, import_ref=record.id))
+    if not rows:
+        return 0
+    statement = (
+        pg_insert(Profits.__table__)
+        .on_conflict_do_nothing(index_elements=["stockn", "date"])
+        .returning(Profits.__table__.c.id)
+    )
+    return len(session.execute(statement, rows).all())
+
+def _import_result(cars_added=0, cars_updated=0, profits_added=0, rows_read=0, timings=None,
+                   queries=0, duration=0.0, error=None, cars_unchanged=0) -> dict:
+    """
+    Результат импорта: счетчики строк (cars_updated — перезаписанные машины, cars_unchanged — машины
+    без изменений, которые не перезаписывались), метрики производительности по этапам
+    и текст ошибки, если импорт не удался.
+    """
+    return {
+        "cars_added": cars_added,
+        "cars_updated": cars_updated,
+        "cars_unchanged": cars_unchanged,
+        "profits_added": profits_added,
+        "rows_read": rows_read,
+        "timings": {stage: round((timings or {}).get(stage, 0.0), 3) for stage in IMPORT_STAGES},
+        "duration": round(duration, 3),
+        "rows_per_second": round(rows_read / duration, 1) if duration else 0.0,
+        "queries": queries,
+        "error": error,
+    }
+
+def file_sha256(file) -> str:
+    """SHA-256 содержимого файла выгрузки (путь или загруженный файл), читается блоками."""
+    digest = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 20), b''):
+                digest.update(block)
+    else:
+        file.seek(0)
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+        file.seek(0)
+    return digest.hexdigest()
+
+def _file_name(file) -> str:
+    return os.path.basename(file) if isinstance(file, (str, os.PathLike)) else getattr(file, 'name', None)
+
+def _register_import(session: Session, snapshot_date, snapshots: int, file_name: str, file_hash: str,
+                     color_mileage_engine: bool) -> Imports:
+    """Добавляет запись реестра импортов в транзакцию импорта; ее id записывается в import_ref строк."""
+    record = Imports(
+        import_id=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        snapshot_date=snapshot_date,
+        snapshots=snapshots,
+        file_name=file_name,
+        file_hash=file_hash,
+        color_mileage_engine=color_mileage_engine,
     )
-    session.add(new_profit)
-    logging.info(f"Добавлена новая запись для stockn {stockn} на дату {new_import_date}: change_amount {change_amount}")
-    return True  # Новая запись добавлена
+    session.add(record)
+    session.flush()
+    return record
+
+def _finish_import(record: Imports, rows_read: int, cars_added: int, cars_updated: int, cars_unchanged: int,
+                   profits_added: int, started: float):
+    """Записывает в реестр итоги импорта перед фиксацией транзакции."""
+    record.rows_read = rows_read
+    record.cars_added = cars_added
+    record.cars_updated = cars_updated
+    record.cars_unchanged = cars_unchanged
+    record.profits_added = profits_added
+    record.duration = round(time.perf_counter() - started, 3)
 
-def import_data_from_excel(file, selected_date: str, color_mileage_engine: bool = False) -> dict:
+def import_data_from_excel(file, selected_date: str, color_mileage_engine: bool = False,
+                           chunk_size: int = IMPORT_CHUNK_SIZE, file_format: str = None,
+                           progress_callback=None, file_name: str = None) -> dict:
+    """
+    Импортирует файл выгрузки (xlsx, csv или parquet) блоками по chunk_size строк.
+    Пиковое потребление памяти зависит от размера блока, а не от размера файла;
+    все блоки записываются в одной транзакции.
+    progress_callback(rows_read, total_rows) вызывается после каждого блока; total_rows — оценка
+    числа строк файла или None, если ее нельзя получить без чтения файла.
+    Кроме счетчиков строк возвращает время этапов (timings), скорость и число SQL-запросов.
+    Импорт записывается в реестр imports (file_name — имя для реестра, по умолчанию имя файла).
+    """
     session: Session = SessionLocal()
     cars_added = 0
     cars_updated = 0
+    cars_unchanged = 0
     profits_added = 0
+    rows_read = 0
+    timings = {}
+    recomputed_dates = set()
+    changed_stockns = set()
+    started = time.perf_counter()
 
     try:
-        import_id = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        df = pd.read_excel(file).where(pd.notnull, None)
-
         # Преобразуем selected_date в объект date, если это строка
         if isinstance(selected_date, str):
             selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
 
-        # Преобразуем значения столбцов с датами и заменяем NaT на None
-        date_columns = ['inventoried', 'breakevendate', 'dismantled']
-        for column in date_columns:
-            if column in df.columns:
-                df[column] = pd.to_datetime(df[column], errors='coerce').dt.date
-                df[column] = df[column].apply(lambda x: x if pd.notnull(x) else None)
+        total_rows = estimate_import_rows(file, file_format) if progress_callback else None
 
-        if df.empty:
-            logging.error("Файл Excel пустой или содержит некорректные данные.")
-            return {"cars_added": 0, "cars_updated": 0, "profits_added": 0}
+        # Секция месяца создается до транзакции импорта, чтобы не держать блокировки до ее фиксации
+        if not color_mileage_engine:
+            ensure_profit_partitions([selected_date])
 
-        # Словарь для хранения обновленных автомобилей
-        updated_cars = {}
+        with count_queries(session.connection()) as counter:
+            record = _register_import(session, selected_date, 0 if color_mileage_engine else 1,
+                                      file_name or _file_name(file), file_sha256(file), color_mileage_engine)
+            import_id = record.import_id
+            chunks = read_import_chunks(file, chunk_size, file_format)
+            while True:
+                with _stage_timer(timings, "parse"):
+                    df = next(chunks, None)
+                if df is None:
+                    break
+                rows_read += len(df)
+                added, updated, unchanged, profits = _import_chunk(session, df, selected_date, record,
+                                                                    color_mileage_engine, timings, recomputed_dates,
+                                                                    changed_stockns)
+                cars_added += added
+                cars_updated += updated
+                cars_unchanged += unchanged
+                profits_added += profits
+                if progress_callback:
+                    progress_callback(rows_read, total_rows)
 
-        for _, row in df.iterrows():
-            stockn = int(row.get('Stock #') if color_mileage_engine else row.get('vstockno', 0))
-            if stockn < 10400:
-                logging.info(f"Пропущен stockn={stockn}, так как он меньше 10400.")
-                continue
+            if rows_read == 0:
+                logging.error("Файл пустой или содержит некорректные данные.")
+                return _import_result(error="Файл пустой или содержит некорректные данные.")
 
-            # Обработка данных в таблице Cars
-            car = session.query(Cars).filter(Cars.stockn == stockn).first()
-            if not car:
-                # Добавление нового автомобиля в таблицу Cars, если его нет
-                car = Cars(
-                    stockn=stockn,
-                    color=row.get('Color'),
-                    milage=clean_milage(row.get('Odo Reading')),
-                    engine=row.get('Engine'),
-                    import_id=import_id,
-                )
-                if not color_mileage_engine:
-                    # Заполнение дополнительных полей для первого типа файла
-                    car.make = row.get('manufacturer')
-                    car.model = row.get('modelname')
-                    car.year = row.get('modelyear')
-                    car.location = create_location(row.get('bin'), row.get('xcoord'))
-                    car.cost = row.get('cost')
-                    car.inventoried = row.get('inventoried')
-                    car.breakevendate = row.get('breakevendate')
-                    car.dismantled = row.get('dismantled')
-                    car.status = 'scrap' if car.dismantled else 'active'
-                    car.age = calculate_age(row.get('inventoried')) if row.get('inventoried') else None
-                    car.payback = calculate_payback(row.get('breakevendate'), row.get('inventoried')) if row.get('breakevendate') and row.get('inventoried') else None
-                session.add(car)
-                cars_added += 1
-            else:
-                if not color_mileage_engine:
-                    # Обновление всех полей для первого типа файла
-                    car.make = row.get('manufacturer') or car.make
-                    car.model = row.get('modelname') or car.model
-                    car.year = row.get('modelyear') or car.year
-                    car.color = row.get('Color') or car.color
-                    car.milage = clean_milage(row.get('Odo Reading')) or car.milage
-                    car.engine = row.get('Engine') or car.engine
-                    car.cost = row.get('cost') or car.cost
-                    car.inventoried = row.get('inventoried') or car.inventoried
-                    car.breakevendate = row.get('breakevendate') or car.breakevendate
-                    car.dismantled = row.get('dismantled') or car.dismantled
-                    car.status = 'scrap' if car.dismantled else 'active'
-                    cars_updated += 1
-                else:
-                    # Обновление только полей color, milage, engine для второго типа файла
-                    car.color = row.get('Color') or car.color
-                    car.milage = clean_milage(row.get('Odo Reading')) or car.milage
-                    car.engine = row.get('Engine') or car.engine
-                    cars_updated += 1
-
-            # Сохраняем обновленный автомобиль для последующего расчета
+            # Итоги площадки: дата импорта, даты с пересчитанным change_amount и прежние снимки машин
+            # с измененными make, cost или dismantled
             if not color_mileage_engine:
-                updated_cars[stockn] = car
+                with _stage_timer(timings, "portfolio"):
+                    refresh_portfolio_daily(session, recomputed_dates | {selected_date}, changed_stockns)
 
-        # Обработка данных для Profits (только если color_mileage_engine=False)
-        if not color_mileage_engine:
-            for _, row in df.iterrows():
-                stockn = int(row.get('Stock #') if color_mileage_engine else row.get('vstockno', 0))
-                if stockn < 10400:
-                    continue
-                cumulative_amount = row.get('sales')
-                new_profit_added = calculate_change_amount_for_import(
-                    session,
-                    stockn,
-                    selected_date,
-                    cumulative_amount,
-                    import_id  # Передаем import_id в функцию
-                )
-                if new_profit_added:
-                    profits_added += 1
-
-            # Сбрасываем изменения в сессии, чтобы новые записи Profits были видны
-            session.flush()
-
-            # Рассчитываем profit и xs для обновленных автомобилей
-            for stockn, car in updated_cars.items():
-                car.profit = calculate_profit(session, stockn, car.cost)
-                car.xs = calculate_xs(session, stockn, car.cost)
-
-        # Сохранение всех изменений
-        session.commit()
-
-        return {"cars_added": cars_added, "cars_updated": cars_updated, "profits_added": profits_added}
+            # Сохранение всех изменений
+            with _stage_timer(timings, "commit"):
+                _finish_import(record, rows_read, cars_added, cars_updated, cars_unchanged, profits_added, started)
+                bump_data_version(session)
+                session.commit()
+
+        # Обновляем аналитическую выгрузку: снимок за дату импорта, снимки с пересчитанным change_amount
+        # и Cars (только Cars для импорта цвета)
+        refresh_analytics([] if color_mileage_engine else sorted(recomputed_dates | {selected_date}))
+
+        result = _import_result(cars_added, cars_updated, profits_added, rows_read, timings,
+                                counter["queries"], time.perf_counter() - started, cars_unchanged=cars_unchanged)
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["timings"].items())
+        logging.info(
+            f"Импорт {import_id}: {rows_read} строк за {result['duration']:.2f}s "
+            f"({result['rows_per_second']:.0f} строк/с, {result['queries']} запросов); "
+            f"добавлено {cars_added}, обновлено {cars_updated}, без изменений {cars_unchanged}, Profits {profits_added}; {stages}."
+        )
+        return result
 
     except Exception as e:
         session.rollback()
         logging.error(f"Ошибка при импорте данных: {e}")
-        return {"cars_added": 0, "cars_updated": 0, "profits_added": 0}
+        return _import_result(error=str(e))
     finally:
         session.close()
 
-def create_location(bin_value, xcoord_value) -> str:
-    """Создает строку location на основе bin и xcoord."""
-    bin_value = bin_value if pd.notna(bin_value) else ''
-    xcoord_value = xcoord_value if pd.notna(xcoord_value) else ''
-    return f"{bin_value}.{xcoord_value}" if bin_value and xcoord_value else bin_value or xcoord_value
+def import_snapshots_batch(snapshots, chunk_size: int = IMPORT_CHUNK_SIZE, progress_callback=None,
+                           file_name: str = None) -> dict:
+    """
+    Пакетный импорт истории: принимает пары (файл, дата) полных выгрузок и загружает их по возрастанию дат
+    в одной транзакции с одной записью реестра imports (и одним import_id) на весь пакет.
+    Cars обновляются по каждому файлу в порядке дат, как при последовательном импорте;
+    change_amount для всех снимков считается в памяти одним проходом (_compute_change_amounts),
+    и все записи Profits пишутся одним пакетным INSERT. profit/xs пересчитываются один раз в конце.
+    Возвращает тот же набор полей, что import_data_from_excel, и количество снимков.
+    """
+    session: Session = SessionLocal()
+    cars_added = 0
+    cars_updated = 0
+    cars_unchanged = 0
+    profits_added = 0
+    rows_read = 0
+    timings = {}
+    changed_stockns = set()
+    started = time.perf_counter()
+
+    try:
+        snapshots = sorted(
+            ((file, datetime.strptime(snapshot_date, '%Y-%m-%d').date() if isinstance(snapshot_date, str) else snapshot_date)
+             for file, snapshot_date in snapshots),
+            key=lambda snapshot: snapshot[1],
+        )
+
+        total_rows = None
+        if progress_callback:
+            estimates = [estimate_import_rows(file) for file, _ in snapshots]
+            total_rows = None if None in estimates else sum(estimates)
+
+        ensure_profit_partitions([snapshot_date for _, snapshot_date in snapshots])
+
+        profit_frames = []
+        with count_queries(session.connection()) as counter:
+            batch_hash = hashlib.sha256("".join(file_sha256(file) for file, _ in snapshots).encode()).hexdigest()
+            record = _register_import(session, snapshots[-1][1], len(snapshots),
+                                      file_name or ", ".join(str(_file_name(file)) for file, _ in snapshots),
+                                      batch_hash, False)
+            import_id = record.import_id
+            for file, snapshot_date in snapshots:
+                chunks = read_import_chunks(file, chunk_size)
+                while True:
+                    with _stage_timer(timings, "parse"):
+                        df = next(chunks, None)
+                    if df is None:
+                        break
+                    rows_read += len(df)
+                    with _stage_timer(timings, "normalize"):
+                        frame = normalize_import_frame(df, False)
+                        if not frame.empty:
+                            cars, insert_columns, update_columns = _prepare_cars(session, frame, record, False)
+                            profit_frames.append(pd.DataFrame({
+                                "stockn": frame["stockn"],
+                                "date": snapshot_date,
+                                "cumulative_amount": frame["sales"],
+                            }))
+                    if not frame.empty:
+                        with _stage_timer(timings, "cars_upsert"):
+                            # profit/xs пакета пересчитываются в конце, поэтому сравниваются только отпечатки
+                            cars, added, updated, unchanged = _skip_unchanged(cars)
+                            _upsert_cars(session, cars[insert_columns], update_columns)
+                            changed_stockns.update(_changed_stockns(cars))
+                        cars_added += added
+                        cars_updated += updated
+                        cars_unchanged += unchanged
+                    if progress_callback:
+                        progress_callback(rows_read, total_rows)
+
+            if rows_read == 0 or not profit_frames:
+                logging.error("Файлы пакета пустые или содержат некорректные данные.")
+                return _import_result(error="Файлы пакета пустые или содержат некорректные данные.")
+
+            with _stage_timer(timings, "profits_insert"):
+                # Повтор stockn в одном файле уже снят normalize_import_frame (остается последняя строка файла).
+                # Если в пакете несколько файлов за одну дату, как и при повторном импорте за эту дату
+                # (ON CONFLICT DO NOTHING), сохраняется запись первого из них
+                profits = pd.concat(profit_frames, ignore_index=True).drop_duplicates(subset=["stockn", "date"], keep="first")
+                profits = _compute_change_amounts(session, profits)
+                profits_added = _insert_profit_history(session, profits, record)
+                stockns = profits["stockn"].dropna().astype(int).unique().tolist()
+                # Уже сохраненные снимки внутри и после интервала пакета считаются от новых предыдущих снимков
+                recomputed_dates = recompute_change_amounts(session, stockns, snapshots[0][1])
+                refresh_latest_state(session, stockns)
+
+            with _stage_timer(timings, "profit_xs"):
+                recalculate_cars_data(session, stockns)
+
+            with _stage_timer(timings, "portfolio"):
+                refresh_portfolio_daily(session, {snapshot_date for _, snapshot_date in snapshots} | set(recomputed_dates),
+                                        changed_stockns)
+
+            with _stage_timer(timings, "commit"):
+                _finish_import(record, rows_read, cars_added, cars_updated, cars_unchanged, profits_added, started)
+                bump_data_version(session)
+                session.commit()
+
+        refresh_analytics(sorted({snapshot_date for _, snapshot_date in snapshots} | set(recomputed_dates)))
+
+        result = _import_result(cars_added, cars_updated, profits_added, rows_read, timings,
+                                counter["queries"], time.perf_counter() - started, cars_unchanged=cars_unchanged)
+        result["snapshots"] = len(snapshots)
+        logging.info(
+            f"Пакетный импорт {import_id}: {len(snapshots)} снимков, {rows_read} строк за {result['duration']:.2f}s "
+            f"({result['rows_per_second']:.0f} строк/с, {result['queries']} запросов); "
+            f"добавлено {cars_added}, обновлено {cars_updated}, без изменений {cars_unchanged}, Profits {profits_added}."
+        )
+        return result
+
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Ошибка при пакетном импорте: {e}")
+        return _import_result(error=str(e))
+    finally:
+        session.close()
+
+def estimate_import_rows(file, file_format: str = None):
+    """
+    Оценка числа строк данных в файле для индикатора прогресса без чтения всего файла:
+    из метаданных Parquet или из размеров листа Excel. Для CSV возвращает None.
+    """
+    file_format = file_format or detect_file_format(file)
+    try:
+        if file_format == 'parquet':
+            return pq.ParquetFile(file).metadata.num_rows
+        if file_format == 'xlsx':
+            workbook = load_workbook(file, read_only=True, data_only=True)
+            try:
+                max_row = workbook.active.max_row
+            finally:
+                workbook.close()
+            return max_row - 1 if max_row else None
+        return None
+    except Exception:
+        return None
+    finally:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+def detect_file_format(file) -> str:
+    """Определяет формат файла выгрузки по расширению имени: xlsx, csv или parquet."""
+    name = file if isinstance(file, str) else getattr(file, 'name', '') or ''
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return extension if extension in ('csv', 'parquet') else 'xlsx'
+
+def read_import_chunks(file, chunk_size: int = IMPORT_CHUNK_SIZE, file_format: str = None):
+    """
+    Потоково читает файл выгрузки и отдает DataFrame-блоки не длиннее chunk_size строк.
+    Excel читается построчно через openpyxl в режиме read-only, CSV — через
+    pd.read_csv(chunksize=...), Parquet — пакетами pyarrow.
+    """
+    file_format = file_format or detect_file_format(file)
+
+    if file_format == 'csv':
+        yield from pd.read_csv(file, chunksize=chunk_size, dtype={column: str for column in CSV_TEXT_COLUMNS})
+        return
+
+    if file_format == 'parquet':
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        buffer = []
+        for row in rows:
+            # Пустые строки в конце листа openpyxl тоже возвращает — пропускаем их
+            if all(value is None for value in row):
+                continue
+            buffer.append(tuple(None if isinstance(value, str) and value in EXCEL_NA_VALUES else value for value in row))
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        workbook.close()
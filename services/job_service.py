@@ -0,0 +1,263 @@
+"""
+Фоновые задачи импорта.
+
+Загруженный файл сохраняется на диск, задача записывается в таблицу import_jobs и выполняется
+в пуле потоков процесса Streamlit, а не в потоке скрипта страницы. Прогресс и результат пишутся
+в import_jobs, поэтому страница может опрашивать задачу и после переподключения браузера.
+
+Несколько процессов приложения могут работать с одной базой, поэтому задача записывает своего
+владельца (owner), а фоновый поток владельца регулярно обновляет heartbeat_at его активных задач.
+Прерванной считается только чужая задача, чей процесс на этом хосте завершился или чей сигнал
+старше config.IMPORT_JOB_LEASE_SECONDS.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+import config
+from database.db import SessionLocal
+from database.models import ImportJob
+from services.import_service import import_data_from_excel, import_snapshots_batch, detect_file_format
+
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+# Владелец задач этого процесса; метка отличает процесс от прежнего с тем же pid
+PROCESS_HOST = socket.gethostname()
+PROCESS_OWNER = f"{PROCESS_HOST}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+@lru_cache(maxsize=None)
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Пул исполнителей, один на процесс. При создании пула запускается поток, который отмечает
+    задачи процесса и помечает прерванными задачи завершившихся процессов.
+    """
+    _fail_interrupted_jobs()
+    threading.Thread(target=_heartbeat_loop, name="import-job-heartbeat", daemon=True).start()
+    return ThreadPoolExecutor(max_workers=config.IMPORT_WORKERS, thread_name_prefix="import-job")
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(config.IMPORT_JOB_HEARTBEAT_SECONDS)
+        _heartbeat()
+        _fail_interrupted_jobs()
+
+def _heartbeat():
+    """Обновляет heartbeat_at активных задач этого процесса."""
+    session: Session = SessionLocal()
+    try:
+        session.execute(
+            update(ImportJob)
+            .where(ImportJob.owner == PROCESS_OWNER, ImportJob.status.in_(JOB_ACTIVE_STATUSES))
+            .values(heartbeat_at=datetime.now())
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Ошибка при обновлении сигнала задач импорта: {e}")
+    finally:
+        session.close()
+
+def _owner_exited(owner: str) -> bool:
+    """Процесс-владелец на этом хосте завершился. Про процессы других хостов судит только аренда."""
+    host, _, rest = (owner or "").partition(":")
+    pid = rest.partition(":")[0]
+    if host != PROCESS_HOST or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:  # Процесс есть, но принадлежит другому пользователю
+        return False
+    return False
+
+def _fail_interrupted_jobs():
+    """
+    Помечает прерванными активные задачи других процессов, если их владелец на этом хосте завершился
+    или сигнал владельца старше config.IMPORT_JOB_LEASE_SECONDS. Задачи этого процесса не трогаются.
+    """
+    session: Session = SessionLocal()
+    try:
+        lease_expired = datetime.now() - timedelta(seconds=config.IMPORT_JOB_LEASE_SECONDS)
+        jobs = session.execute(
+            select(ImportJob.id, ImportJob.owner, ImportJob.heartbeat_at)
+            .where(ImportJob.status.in_(JOB_ACTIVE_STATUSES),
+                   or_(ImportJob.owner.is_(None), ImportJob.owner != PROCESS_OWNER))
+        ).all()
+        interrupted = [job.id for job in jobs
+                       if job.heartbeat_at is None or job.heartbeat_at < lease_expired or _owner_exited(job.owner)]
+        if interrupted:
+            session.execute(
+                update(ImportJob)
+                .where(ImportJob.id.in_(interrupted), ImportJob.status.in_(JOB_ACTIVE_STATUSES))
+                .values(status="failed", error="Задача прервана: процесс приложения, выполнявший ее, остановлен",
+                        finished_at=datetime.now())
+            )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Ошибка при восстановлении задач импорта: {e}")
+    finally:
+        session.close()
+
+def _update_job(job_id: int, **values):
+    """Обновляет поля задачи в отдельной короткой транзакции."""
+    session: Session = SessionLocal()
+    try:
+        session.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Ошибка при обновлении задачи импорта {job_id}: {e}")
+    finally:
+        session.close()
+
+def _save_upload(file) -> Path:
+    """Сохраняет загруженный файл в каталог задач под уникальным именем с исходным расширением."""
+    upload_dir = Path(config.IMPORT_UPLOAD_DIR)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    name = getattr(file, 'name', 'upload.xlsx')
+    path = upload_dir / f"{uuid.uuid4().hex}.{detect_file_format(name)}"
+    path.write_bytes(file.getvalue() if hasattr(file, 'getvalue') else file.read())
+    return path
+
+def submit_import_job(file, selected_date, color_mileage_engine: bool = False) -> int:
+    """
+    Ставит импорт файла в очередь и сразу возвращает id задачи.
+    Задачи выполняются по очереди (config.IMPORT_WORKERS потоков), не блокируя страницы.
+    """
+    executor = _get_executor()  # Вместе с пулом запускается поток сигналов задач процесса
+    path = _save_upload(file)
+    session: Session = SessionLocal()
+    try:
+        job = ImportJob(
+            status="queued",
+            file_name=getattr(file, 'name', path.name),
+            file_path=str(path),
+            snapshot_date=selected_date,
+            color_mileage_engine=color_mileage_engine,
+            rows_read=0,
+            owner=PROCESS_OWNER,
+            heartbeat_at=datetime.now(),
+        )
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    except Exception:
+        session.rollback()
+        path.unlink(missing_ok=True)
+        raise
+    finally:
+        session.close()
+
+    executor.submit(_run_import_job, job_id)
+    return job_id
+
+def submit_batch_import_job(files_with_dates) -> int:
+    """
+    Ставит в очередь пакетный импорт истории: files_with_dates — пары (загруженный файл, дата снимка).
+    Возвращает id задачи.
+    """
+    executor = _get_executor()
+    snapshots = []
+    try:
+        for file, snapshot_date in files_with_dates:
+            path = _save_upload(file)
+            snapshots.append({"file_name": getattr(file, 'name', path.name), "file_path": str(path),
+                              "date": snapshot_date.strftime("%Y-%m-%d")})
+        session: Session = SessionLocal()
+        try:
+            job = ImportJob(
+                status="queued",
+                file_name=f"Пакет из {len(snapshots)} файлов",
+                snapshots=snapshots,
+                snapshot_date=max(snapshot_date for _, snapshot_date in files_with_dates),
+                color_mileage_engine=False,
+                rows_read=0,
+                owner=PROCESS_OWNER,
+                heartbeat_at=datetime.now(),
+            )
+            session.add(job)
+            session.commit()
+            job_id = job.id
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    except Exception:
+        for snapshot in snapshots:
+            Path(snapshot["file_path"]).unlink(missing_ok=True)
+        raise
+
+    executor.submit(_run_import_job, job_id)
+    return job_id
+
+def _run_import_job(job_id: int):
+    """Выполняет задачу импорта в фоновом потоке и записывает ее прогресс и результат."""
+    session: Session = SessionLocal()
+    try:
+        job = session.get(ImportJob, job_id)
+        file_path, file_name, snapshot_date = job.file_path, job.file_name, job.snapshot_date
+        color_mileage_engine = job.color_mileage_engine
+        snapshots = job.snapshots
+    finally:
+        session.close()
+    file_paths = [snapshot["file_path"] for snapshot in snapshots] if snapshots else [file_path]
+
+    _update_job(job_id, status="running", started_at=datetime.now())
+
+    def on_progress(rows_read, total_rows):
+        _update_job(job_id, rows_read=rows_read, total_rows=total_rows)
+
+    try:
+        if snapshots:
+            result = import_snapshots_batch([(snapshot["file_path"], snapshot["date"]) for snapshot in snapshots],
+                                            progress_callback=on_progress,
+                                            file_name=", ".join(snapshot["file_name"] for snapshot in snapshots))
+        else:
+            result = import_data_from_excel(file_path, snapshot_date.strftime("%Y-%m-%d"), color_mileage_engine,
+                                            progress_callback=on_progress, file_name=file_name)
+        _update_job(
+            job_id,
+            status="failed" if result["error"] else "done",
+            result=result,
+            error=result["error"],
+            rows_read=result["rows_read"],
+            finished_at=datetime.now(),
+        )
+    except Exception as e:
+        logging.error(f"Ошибка задачи импорта {job_id}: {e}")
+        _update_job(job_id, status="failed", error=str(e), finished_at=datetime.now())
+    finally:
+        for path in file_paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+def get_import_jobs(limit: int = 20) -> list:
+    """Последние задачи импорта (всех пользователей), новые первыми."""
+    _get_executor()
+    session: Session = SessionLocal()
+    try:
+        jobs = session.query(ImportJob).order_by(ImportJob.id.desc()).limit(limit).all()
+        session.expunge_all()
+        return jobs
+    finally:
+        session.close()
+
+def has_active_jobs() -> bool:
+    """Есть ли задачи в очереди или в работе."""
+    _get_executor()
+    session: Session = SessionLocal()
+    try:
+        return session.query(ImportJob.id).filter(ImportJob.status.in_(JOB_ACTIVE_STATUSES)).first() is not None
+    finally:
+        session.close()
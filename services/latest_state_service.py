@@ -0,0 +1,69 @@
+from sqlalchemy import func, select, delete, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from database.models import CarLatestState, Profits
+from database.db import SessionLocal
+
+def refresh_latest_state(session: Session, stockns=None) -> int:
+    """
+    Пересчитывает car_latest_state из Profits для заданных stockn:
+    одним INSERT ... SELECT DISTINCT ON ... ON CONFLICT DO UPDATE и удалением строк
+    для stockn, у которых не осталось записей Profits.
+    Фиксацию транзакции выполняет вызывающий код.
+
+    :param stockns: Набор stockn; None — пересчитать таблицу целиком
+    :return: Количество вставленных или обновлённых строк
+    """
+    latest = (
+        select(
+            Profits.stockn,
+            Profits.date,
+            Profits.cumulative_amount,
+            Profits.change_amount,
+            func.count().over(partition_by=Profits.stockn),
+        )
+        .distinct(Profits.stockn)
+        .order_by(Profits.stockn, Profits.date.desc())
+    )
+    orphaned = delete(CarLatestState).where(
+        ~exists().where(Profits.stockn == CarLatestState.stockn)
+    )
+    if stockns is not None:
+        stockns = {int(stockn) for stockn in stockns if stockn is not None}
+        if not stockns:
+            return 0
+        latest = latest.where(Profits.stockn.in_(stockns))
+        orphaned = orphaned.where(CarLatestState.stockn.in_(stockns))
+
+    statement = pg_insert(CarLatestState).from_select(
+        ["stockn", "latest_date", "cumulative_amount", "change_amount", "snapshot_count"],
+        latest,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[CarLatestState.stockn],
+        set_={
+            "latest_date": statement.excluded.latest_date,
+            "cumulative_amount": statement.excluded.cumulative_amount,
+            "change_amount": statement.excluded.change_amount,
+            "snapshot_count": statement.excluded.snapshot_count,
+        },
+    )
+    upserted = session.execute(statement).rowcount
+    session.execute(orphaned.execution_options(synchronize_session=False))
+    return upserted
+
+def rebuild_latest_state():
+    """Полностью перестраивает car_latest_state (первичное заполнение или восстановление)."""
+    session: Session = SessionLocal()
+    try:
+        rows = refresh_latest_state(session)
+        session.commit()
+        print(f"car_latest_state перестроена: {rows} строк.")
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при перестроении car_latest_state: {e}")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    rebuild_latest_state()
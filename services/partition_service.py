@@ -0,0 +1,191 @@
+"""
+Секции таблицы Profits и сжатие старой истории.
+
+Profits секционирована по date: секция profits_ГГГГ_ММ на каждый месяц и profits_default
+для дат без своей секции (миграция 0007). Перед транзакцией записи снимков импорт вызывает
+ensure_profit_partitions, чтобы новые даты попадали в месячные секции, а не в секцию по умолчанию.
+
+Сжатие (compact_profits) оставляет в старых месяцах по одной строке на stockn за месяц:
+последний снимок месяца с известным cumulative_amount и суммой change_amount за месяц.
+Запуск вручную или по расписанию: python -m services.partition_service
+"""
+import logging
+from datetime import date
+from sqlalchemy import and_, delete, func, select, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+import config
+from database.db import SessionLocal
+from database.models import Profits
+from services.latest_state_service import refresh_latest_state
+from services.table_service import bump_data_version
+from services.analytics_service import refresh_analytics
+from services.calculate import recompute_change_amounts
+from services.portfolio_service import refresh_portfolio_daily
+
+DEFAULT_PARTITION = "profits_default"
+# Сколько ждать блокировок при создании секции. Присоединение секции ждет завершения транзакций,
+# читающих Profits, а новые чтения ждут его; после таймаута снимки временно пишутся в секцию по умолчанию
+PARTITION_LOCK_TIMEOUT = "2s"
+LOCK_NOT_AVAILABLE = "55P03"
+
+def _month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    """Имя месячной секции Profits, например profits_2024_01."""
+    return f"profits_{month:%Y_%m}"
+
+def get_profit_partitions(session: Session) -> list:
+    """Имена существующих секций Profits."""
+    return session.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'profits'::regclass ORDER BY child.relname"
+    )).scalars().all()
+
+def ensure_profit_partitions(dates) -> list:
+    """
+    Создает месячные секции Profits для дат, у которых их еще нет.
+    Строки этих месяцев, уже попавшие в секцию по умолчанию, переносятся в новую секцию.
+    Если все секции есть, блокировки не берутся. Иначе секции создаются в отдельной короткой транзакции
+    под advisory-блокировкой, поэтому функцию вызывают до начала транзакции импорта или правки:
+    присоединение секции не должно ждать ее фиксации и задерживать чтение Profits.
+    Если блокировки не получены за PARTITION_LOCK_TIMEOUT, секции не создаются: строки попадут
+    в секцию по умолчанию и будут перенесены следующим вызовом для этого месяца.
+
+    :param dates: Даты снимков, которые будут записаны
+    :return: Имена созданных секций
+    """
+    months = sorted({_month_start(value) for value in dates if value is not None})
+    if not months:
+        return []
+    session: Session = SessionLocal()
+    created = []
+    try:
+        if not set(map(partition_name, months)) - set(get_profit_partitions(session)):
+            return []
+        session.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext('profits_partitions'))"))
+        existing = set(get_profit_partitions(session))
+        for month in months:
+            name = partition_name(month)
+            if name in existing:
+                continue
+            lower, upper = f"{month:%Y-%m-%d}", f"{_next_month(month):%Y-%m-%d}"
+            # Секция заполняется до присоединения: секция по умолчанию не должна содержать строк ее диапазона
+            session.execute(text(f"CREATE TABLE {name} (LIKE profits INCLUDING DEFAULTS)"))
+            session.execute(
+                text(f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date >= :lower AND date < :upper RETURNING *) "
+                     f"INSERT INTO {name} SELECT * FROM moved"),
+                {"lower": lower, "upper": upper},
+            )
+            session.execute(text(f"ALTER TABLE profits ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+            created.append(name)
+        session.commit()
+    except OperationalError as e:
+        session.rollback()
+        if getattr(e.orig, "pgcode", None) != LOCK_NOT_AVAILABLE:
+            raise
+        logging.warning("Секции Profits не созданы: Profits занята другими транзакциями, "
+                        "снимки будут записаны в секцию по умолчанию.")
+        return []
+    finally:
+        session.close()
+    if created:
+        logging.info(f"Созданы секции Profits: {', '.join(created)}.")
+    return created
+
+def _compact_month(session: Session, month: date) -> tuple:
+    """
+    Сжимает один месяц: последний снимок месяца с известным cumulative_amount по каждому stockn
+    (если такого нет — последний снимок) получает сумму change_amount за месяц, остальные снимки
+    месяца удаляются. Так сохраняется последнее известное значение месяца, от которого
+    recompute_change_amounts считает следующий снимок. Запрос затрагивает только секцию этого месяца.
+    Возвращает (число удаленных строк, затронутые stockn, затронутые даты).
+    """
+    in_month = and_(Profits.date >= month, Profits.date < _next_month(month))
+    month_window = {"partition_by": Profits.stockn}
+    snapshots = (
+        select(
+            Profits.id,
+            Profits.date,
+            func.row_number().over(order_by=(Profits.cumulative_amount.is_(None), Profits.date.desc()),
+                                   **month_window).label("position"),
+            func.count().over(**month_window).label("snapshots"),
+            func.sum(Profits.change_amount).over(**month_window).label("month_change"),
+        )
+        .where(in_month)
+        .subquery()
+    )
+    updated = session.execute(
+        update(Profits)
+        .where(in_month, Profits.id == snapshots.c.id, Profits.date == snapshots.c.date,
+               snapshots.c.position == 1, snapshots.c.snapshots > 1)
+        .values(change_amount=snapshots.c.month_change)
+        .returning(Profits.stockn, Profits.date)
+        .execution_options(synchronize_session=False)
+    ).all()
+    deleted = session.execute(
+        delete(Profits)
+        .where(in_month, Profits.id == snapshots.c.id, Profits.date == snapshots.c.date, snapshots.c.position > 1)
+        .returning(Profits.date)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    return len(deleted), {row.stockn for row in updated}, {row.date for row in updated} | set(deleted)
+
+def compact_profits(keep_months: int = None) -> dict:
+    """
+    Сжимает историю Profits старше keep_months месяцев (по умолчанию config.PROFITS_COMPACT_AFTER_MONTHS)
+    до одной строки на stockn за месяц. Каждый месяц сжимается в отдельной транзакции.
+    Повторный запуск ничего не меняет в уже сжатых месяцах.
+
+    :return: Словарь с количеством сжатых месяцев и удалённых строк
+    """
+    keep_months = config.PROFITS_COMPACT_AFTER_MONTHS if keep_months is None else keep_months
+    months_total = date.today().year * 12 + date.today().month - 1 - keep_months
+    cutoff = date(months_total // 12, months_total % 12 + 1, 1)
+
+    session: Session = SessionLocal()
+    compacted_months = 0
+    rows_deleted = 0
+    changed_dates = set()
+    try:
+        months = session.execute(
+            select(func.date_trunc("month", Profits.date).label("month"))
+            .where(Profits.date < cutoff)
+            .group_by("month")
+            .having(func.count() > func.count(func.distinct(Profits.stockn)))
+            .order_by("month")
+        ).scalars().all()
+        for month in months:
+            deleted, stockns, dates = _compact_month(session, _month_start(month))
+            # Следующие снимки сверяются с историей после сжатия
+            dates |= set(recompute_change_amounts(session, stockns, _month_start(month)))
+            refresh_latest_state(session, stockns)
+            refresh_portfolio_daily(session, dates)
+            bump_data_version(session)
+            session.commit()
+            compacted_months += 1
+            rows_deleted += deleted
+            changed_dates |= dates
+            logging.info(f"Profits за {month:%Y-%m} сжаты: удалено {deleted} строк.")
+
+        if changed_dates:
+            refresh_analytics(sorted(changed_dates))
+        print(f"Сжатие Profits до {cutoff}: месяцев {compacted_months}, удалено строк {rows_deleted}.")
+        return {"months_compacted": compacted_months, "rows_deleted": rows_deleted}
+
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при сжатии Profits: {e}")
+        return {"months_compacted": compacted_months, "rows_deleted": rows_deleted}
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    compact_profits()
@@ -0,0 +1,103 @@
+"""
+Итоги площадки по датам снимков для графиков динамики (таблица portfolio_daily).
+
+Строка на дату снимка и make плюс итоговая строка по всем make (make = ALL_MAKES) считаются
+одним запросом GROUPING SETS по Profits и Cars. При импорте, удалении и правках пересчитываются
+только затронутые даты: даты измененных снимков и даты снимков машин, у которых изменились
+атрибуты (cost, make, dismantled), поэтому страница динамики читает готовые итоги независимо от глубины истории.
+"""
+import pandas as pd
+from sqlalchemy import and_, case, delete, func, literal, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from database.db import SessionLocal
+from database.models import Cars, PortfolioDaily, Profits
+
+ALL_MAKES = "*"  # Итог по всем make
+NO_MAKE = ""  # Машины без make
+
+PORTFOLIO_COLUMNS = ["snapshot_date", "make", "cars_count", "active_count", "total_cost",
+                     "total_cumulative", "total_change", "total_profit"]
+
+def _portfolio_query(dates=None):
+    """SELECT итогов по дате и make и по дате в целом (GROUPING SETS) для заданных дат или всей истории."""
+    make = func.coalesce(Cars.make, NO_MAKE)
+    # Машина активна на дату снимка, если она еще не разобрана к этой дате
+    active = or_(Cars.dismantled.is_(None), Cars.dismantled > Profits.date)
+    known = and_(Profits.cumulative_amount.isnot(None), Cars.cost.isnot(None))
+    query = (
+        select(
+            Profits.date,
+            case((func.grouping(make) == 1, literal(ALL_MAKES)), else_=make),
+            func.count(),
+            func.count().filter(active),
+            func.sum(Cars.cost),
+            func.sum(Profits.cumulative_amount),
+            func.sum(Profits.change_amount),
+            func.sum(Profits.cumulative_amount - Cars.cost).filter(known),
+        )
+        .join(Cars, Cars.stockn == Profits.stockn)
+        .group_by(func.grouping_sets(tuple_(Profits.date, make), tuple_(Profits.date)))
+    )
+    if dates is not None:
+        query = query.where(Profits.date.in_(dates))
+    return query
+
+def refresh_portfolio_daily(session: Session, dates=None, stockns=None) -> int:
+    """
+    Пересчитывает portfolio_daily за даты снимков dates и за все даты, в которых есть машины stockns
+    (у них изменились атрибуты). Без аргументов перестраивает таблицу целиком.
+    Фиксацию транзакции выполняет вызывающий код.
+
+    :return: Количество пересчитанных дат
+    """
+    if dates is None and stockns is None:
+        target = None
+    else:
+        target = {value for value in (dates or []) if value is not None}
+        stockns = {int(stockn) for stockn in (stockns or []) if stockn is not None}
+        if stockns:
+            target |= set(session.execute(
+                select(Profits.date).where(Profits.stockn.in_(stockns)).distinct()
+            ).scalars().all())
+        if not target:
+            return 0
+        target = sorted(target)
+
+    cleared = delete(PortfolioDaily)
+    if target is not None:
+        cleared = cleared.where(PortfolioDaily.snapshot_date.in_(target))
+    session.execute(cleared.execution_options(synchronize_session=False))
+    session.execute(pg_insert(PortfolioDaily).from_select(PORTFOLIO_COLUMNS, _portfolio_query(target)))
+    return len(target) if target is not None else session.query(func.count(func.distinct(PortfolioDaily.snapshot_date))).scalar()
+
+def get_portfolio_daily(session: Session, make: str = ALL_MAKES) -> pd.DataFrame:
+    """Итоги по датам снимков для одного make (по умолчанию — по всем make) в порядке дат."""
+    rows = session.execute(
+        select(*[getattr(PortfolioDaily, column) for column in PORTFOLIO_COLUMNS])
+        .where(PortfolioDaily.make == make)
+        .order_by(PortfolioDaily.snapshot_date)
+    ).all()
+    return pd.DataFrame(rows, columns=PORTFOLIO_COLUMNS)
+
+def get_portfolio_makes(session: Session) -> list:
+    """Список make, по которым есть итоги."""
+    return session.execute(
+        select(PortfolioDaily.make).where(PortfolioDaily.make != ALL_MAKES).distinct().order_by(PortfolioDaily.make)
+    ).scalars().all()
+
+def rebuild_portfolio_daily():
+    """Полностью перестраивает portfolio_daily (первичное заполнение или восстановление)."""
+    session: Session = SessionLocal()
+    try:
+        dates = refresh_portfolio_daily(session)
+        session.commit()
+        print(f"portfolio_daily перестроена: {dates} дат.")
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при перестроении portfolio_daily: {e}")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    rebuild_portfolio_daily()
@@ -1,11 +1,44 @@
 
-from sqlalchemy.orm import Session
-from database.models import Cars
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, Query
+from database.models import Cars, DataVersion, Profits
 import pandas as pd
+from datetime import date
+
+STOCK_PAGE_SIZE = 200
+PROFITS_BLOCK_SIZE = 500
+
+# Столбцы грида Profits; по ним же разрешена сортировка на стороне базы
+PROFITS_GRID_COLUMNS = ["id", "stockn", "date", "cumulative_amount", "change_amount", "import_id"]
+
+# Столбцы страницы Stock View; age и payback вычисляются в запросе
+STOCK_VIEW_COLUMNS = [
+    Cars.stockn, Cars.make, Cars.model, Cars.year, Cars.color, Cars.cost, Cars.profit, Cars.xs,
+    Cars.current_payback.label("payback"), Cars.current_age.label("age"),
+    Cars.milage, Cars.engine, Cars.location
+]
+
+def get_data_version(session: Session) -> int:
+    """
+    Возвращает текущую версию данных. Версия меняется при импорте, удалении и правках таблиц,
+    поэтому по ней можно кэшировать выборки между перезапусками скрипта Streamlit.
+    """
+    return session.query(DataVersion.version).filter(DataVersion.id == 1).scalar() or 0
+
+def bump_data_version(session: Session):
+    """Увеличивает версию данных в текущей транзакции; фиксацию выполняет вызывающий код."""
+    statement = pg_insert(DataVersion).values(id=1, version=1, updated_at=func.now())
+    statement = statement.on_conflict_do_update(
+        index_elements=[DataVersion.id],
+        set_={"version": DataVersion.version + 1, "updated_at": func.now()},
+    )
+    session.execute(statement)
 
 def fetch_cars_data(session: Session) -> pd.DataFrame:
     """
     Извлекает все данные из таблицы Cars и возвращает их в формате DataFrame для дальнейшей обработки.
+    age и payback вычисляются в запросе из дат, а не читаются из хранимых столбцов.
     """
     query = session.query(
         Cars.stockn,
@@ -21,8 +54,8 @@ def fetch_cars_data(session: Session) -> pd.DataFrame:
         Cars.breakevendate,
         Cars.dismantled,
         Cars.purchesdate,
-        Cars.age,
-        Cars.payback,
+        Cars.current_age.label("age"),
+        Cars.current_payback.label("payback"),
         Cars.profit,
         Cars.xs,
         Cars.status,
@@ -37,3 +70,187 @@ def fetch_cars_data(session: Session) -> pd.DataFrame:
     ]
     df = pd.DataFrame(query, columns=columns)
     return df
+
+
+def apply_cars_filters(query: Query, filters: dict) -> Query:
+    """
+    Добавляет к запросу по Cars условия фильтров Stock View.
+    Пустые значения не фильтруют; диапазоны, как и раньше, отбрасывают строки с NULL.
+    """
+    if filters.get('statuses'):
+        query = query.filter(Cars.status.in_(filters['statuses']))
+    for field in ('make', 'model', 'year', 'color'):
+        if filters.get(field) not in (None, ""):
+            query = query.filter(getattr(Cars, field) == filters[field])
+
+    ranges = {
+        'possession_range': Cars.current_age,
+        'cost_range': Cars.cost,
+        'xs_range': Cars.xs,
+    }
+    for key, column in ranges.items():
+        if filters.get(key) is not None:
+            low, high = filters[key]
+            query = query.filter(column.between(low, high))
+    return query
+
+def fetch_cars_page(session: Session, filters: dict, after_stockn=None,
+                    page_size: int = STOCK_PAGE_SIZE) -> pd.DataFrame:
+    """
+    Возвращает одну страницу отфильтрованных машин по убыванию stockn.
+    Используется keyset-пагинация: следующая страница начинается после последнего stockn предыдущей,
+    поэтому стоимость запроса не зависит от номера страницы.
+    """
+    query = apply_cars_filters(session.query(*STOCK_VIEW_COLUMNS), filters)
+    if after_stockn is not None:
+        query = query.filter(Cars.stockn < after_stockn)
+    rows = query.order_by(Cars.stockn.desc()).limit(page_size).all()
+    return pd.DataFrame(rows, columns=[column.key for column in STOCK_VIEW_COLUMNS])
+
+def fetch_cars_totals(session: Session, filters: dict) -> dict:
+    """Сводные данные по всем отфильтрованным машинам, посчитанные базой одним запросом."""
+    payback = Cars.current_payback
+    query = apply_cars_filters(session.query(
+        func.count(Cars.id),
+        func.coalesce(func.sum(Cars.cost), 0),
+        func.coalesce(func.sum(Cars.profit), 0),
+        func.coalesce(func.avg(Cars.xs), 0),
+        func.coalesce(func.avg(payback).filter(payback > 0), 0),
+    ), filters)
+    stock_count, total_cost, total_profit, avg_xs, avg_payback = query.one()
+    return {
+        'stock_count': stock_count,
+        'total_cost': float(total_cost),
+        'total_profit': float(total_profit),
+        'avg_xs': float(avg_xs),
+        'avg_payback': float(avg_payback),
+    }
+
+def fetch_filter_options(session: Session, make: str = None) -> dict:
+    """
+    Значения для фильтров Stock View: списки make/color/year (и model для выбранного make)
+    и границы слайдеров, без загрузки всей таблицы.
+    """
+    def distinct_values(column, *criteria):
+        rows = session.query(column).filter(column.isnot(None), *criteria).distinct().order_by(column).all()
+        return [row[0] for row in rows]
+
+    age = Cars.current_age
+    bounds = session.query(
+        func.min(age), func.max(age),
+        func.min(Cars.cost), func.max(Cars.cost),
+        func.min(Cars.xs), func.max(Cars.xs),
+    ).one()
+
+    return {
+        'makes': distinct_values(Cars.make),
+        'models': distinct_values(Cars.model, Cars.make == make) if make else [],
+        'colors': distinct_values(Cars.color),
+        'years': distinct_values(Cars.year),
+        'possession_range': (int(bounds[0] or 0), int(bounds[1] or 0)),
+        'cost_range': (int(bounds[2] or 0), int(bounds[3] or 0)),
+        'xs_range': (float(bounds[4] or 0), float(bounds[5] or 0)),
+    }
+
+def _coerce_like(values: pd.Series, original: pd.Series) -> pd.Series:
+    """Приводит значения из грида (строки, числа JavaScript) к типу исходного столбца для сравнения."""
+    if pd.api.types.is_numeric_dtype(original):
+        return pd.to_numeric(values, errors='coerce')
+    sample = original.dropna()
+    if not sample.empty and isinstance(sample.iloc[0], date):
+        parsed = pd.to_datetime(values, errors='coerce')
+        return parsed.dt.date.astype(object).where(parsed.notna(), None)
+    return values.astype(object).where(values.notna(), None)
+
+def diff_frames(original: pd.DataFrame, edited: pd.DataFrame, key: str = "id",
+                readonly=("id", "stockn")) -> tuple:
+    """
+    Векторное сравнение исходной и отредактированной таблицы по ключу key.
+    Возвращает (values, changed): значения из отредактированной таблицы и маску измененных ячеек,
+    обе с индексом key и только по строкам, где что-то изменилось. Столбцы readonly не сравниваются.
+    Сравниваются только строки, которые есть в обеих таблицах: грид может вернуть отфильтрованную
+    или переупорядоченную часть строк, и отсутствующие в ней строки не считаются измененными.
+    """
+    original = original.set_index(key)
+    edited = edited.set_index(key)
+    original = original.loc[original.index.intersection(edited.index, sort=False)]
+    edited = edited.loc[~edited.index.duplicated()].reindex(original.index)
+    columns = [column for column in original.columns if column not in readonly and column in edited.columns]
+
+    values = pd.DataFrame({column: _coerce_like(edited[column], original[column]) for column in columns},
+                          index=original.index)
+    changed = pd.DataFrame({
+        column: ~((original[column] == values[column]) | (original[column].isna() & values[column].isna()))
+        for column in columns
+    }, index=original.index)
+    rows = changed.any(axis=1)
+    return values[rows], changed[rows]
+
+def _python_value(value):
+    """Значение ячейки для драйвера БД: None вместо NaN/NaT, встроенные типы вместо numpy."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+def bulk_update_changes(session: Session, table_model, original: pd.DataFrame, edited: pd.DataFrame,
+                        key: str = "id", readonly=("id", "stockn")) -> pd.Index:
+    """
+    Записывает в таблицу только измененные ячейки: строки группируются по набору измененных столбцов,
+    и каждая группа отправляется одним UPDATE ... WHERE id = :key (executemany). Столбцы readonly не записываются.
+    Фиксацию транзакции выполняет вызывающий код. Возвращает ключи измененных строк.
+    """
+    values, changed = diff_frames(original, edited, key, readonly)
+    if values.empty:
+        return values.index
+
+    table = table_model.__table__
+    changed_columns = changed.apply(lambda row: tuple(row.index[row]), axis=1)
+    for columns, group in values.groupby(changed_columns):
+        statement = (
+            update(table)
+            .where(table.c[key] == bindparam("_key"))
+            .values({column: bindparam(column) for column in columns})
+        )
+        params = [
+            {"_key": _python_value(row_key), **{column: _python_value(row[column]) for column in columns}}
+            for row_key, row in group[list(columns)].iterrows()
+        ]
+        session.execute(statement, params)
+    return values.index
+
+def apply_profits_filters(query: Query, filters: dict) -> Query:
+    """Фильтры грида Profits: stockn, интервал дат и import_id; пустые значения не фильтруют."""
+    if filters.get('stockn'):
+        query = query.filter(Profits.stockn == filters['stockn'])
+    if filters.get('date_from'):
+        query = query.filter(Profits.date >= filters['date_from'])
+    if filters.get('date_to'):
+        query = query.filter(Profits.date <= filters['date_to'])
+    if filters.get('import_id'):
+        query = query.filter(Profits.import_id == filters['import_id'])
+    return query
+
+def count_profits(session: Session, filters: dict) -> int:
+    """Количество строк Profits под фильтрами (для числа блоков грида)."""
+    return apply_profits_filters(session.query(func.count(Profits.id)), filters).scalar()
+
+def fetch_profits_block(session: Session, filters: dict, sort_by: str = "stockn", descending: bool = True,
+                        offset: int = 0, limit: int = PROFITS_BLOCK_SIZE) -> pd.DataFrame:
+    """
+    Один блок отсортированных и отфильтрованных строк Profits.
+    Сортировка и фильтрация выполняются в базе, в памяти находится только запрошенный блок;
+    id добавляется в сортировку, чтобы порядок строк между блоками был однозначным.
+    """
+    if sort_by not in PROFITS_GRID_COLUMNS:
+        raise ValueError(f"Недопустимый столбец сортировки: {sort_by}")
+    columns = [getattr(Profits, column) for column in PROFITS_GRID_COLUMNS]
+    sort_column = getattr(Profits, sort_by)
+    order = [sort_column.desc() if descending else sort_column.asc(), Profits.id.desc() if descending else Profits.id.asc()]
+    rows = (
+        apply_profits_filters(session.query(*columns), filters)
+        .order_by(*order)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return pd.DataFrame(rows, columns=PROFITS_GRID_COLUMNS)
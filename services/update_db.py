@@ -1,7 +1,14 @@
 from datetime import date, datetime
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from database.models import Cars, Profits
-from services.calculate import calculate_age, calculate_profit, calculate_xs
+from database.models import Cars
+from services.calculate import calculate_profit_xs_batch, recompute_change_amounts
+from services.delete_service import recalculate_cars_data
+from services.analytics_service import refresh_analytics
+from services.portfolio_service import refresh_portfolio_daily
+from services.latest_state_service import refresh_latest_state
+from services.table_service import bump_data_version
+import pandas as pd
 from database.db import SessionLocal
 
 # Функция для обновления значений profit и xs для всех автомобилей
@@ -9,18 +16,15 @@ def update_profit_and_xs():
     session: Session = SessionLocal()
     try:
         cars = session.query(Cars).all()
-        for car in cars:
-            # Получаем последний cumulative_amount для stockn
-            last_cumulative_amount = (
-                session.query(Profits.cumulative_amount)
-                .filter(Profits.stockn == car.stockn)
-                .order_by(Profits.date.desc())
-                .first()
-            )
-            if last_cumulative_amount:
-                car.profit = calculate_profit(session, car.stockn, car.cost)
-                car.xs = calculate_xs(session, car.stockn, car.cost)
+        # Получаем последний cumulative_amount сразу для всех stockn одним запросом
+        calculated = calculate_profit_xs_batch(session, [car.stockn for car in cars], [car.cost for car in cars])
+        for car, row in zip(cars, calculated.itertuples(index=False)):
+            if pd.notna(row.cumulative_amount):
+                car.profit = None if pd.isna(row.profit) else int(row.profit)
+                car.xs = None if pd.isna(row.xs) else float(row.xs)
+        bump_data_version(session)
         session.commit()
+        refresh_analytics([])  # Изменились только Cars
         print("Profit и Xs обновлены для всех автомобилей.")
     except Exception as e:
         session.rollback()
@@ -28,46 +32,46 @@ def update_profit_and_xs():
     finally:
         session.close()
 
-# Функция для обновления profit и xs при каждом новом импорте
+# Полный пересчет change_amount по всей истории (обслуживание): одним UPDATE с окном LAG,
+# затем последнее состояние и profit/xs/payback всех машин
 def update_profit_history():
     session: Session = SessionLocal()
     try:
-        profits = session.query(Profits).all()
-        for profit in profits:
-            car = session.query(Cars).filter_by(stockn=profit.stockn).first()
-            if car:
-                # Обновляем profit и xs для каждой новой записи Profits
-                profit.change_amount = profit.cumulative_amount - car.profit if car.profit else None
-                car.profit = calculate_profit(session, car.stockn, car.cost)
-                car.xs = calculate_xs(session, car.stockn, car.cost)
+        recomputed_dates = recompute_change_amounts(session)
+        refresh_latest_state(session)
+        recalculate_cars_data(session)
+        refresh_portfolio_daily(session, recomputed_dates)
+        bump_data_version(session)
         session.commit()
-        print("ProfitHistory обновлен.")
+        refresh_analytics(recomputed_dates)
+        print(f"ProfitHistory обновлен: change_amount пересчитан в {len(recomputed_dates)} снимках.")
     except Exception as e:
         session.rollback()
         print(f"Ошибка при обновлении ProfitHistory: {e}")
     finally:
         session.close()
 
-# Функция для обновления age один раз в день при запуске
+# Функция для обновления хранимой копии age один раз в день при запуске.
+# Экраны и агрегаты читают age вычисляемым (Cars.current_age), хранимый столбец лишь копия.
 def update_age_daily():
     session: Session = SessionLocal()
     today = date.today()
-    # Проверяем последнюю дату обновления в базе данных
-    last_update = session.query(Cars).filter(Cars.age.isnot(None)).first()
-    if last_update and last_update.age_last_updated == today:
-        # Если age уже обновлен сегодня, пропускаем
-        print("Age уже обновлен сегодня.")
-        session.close()
-        return
-
-    # Обновляем age для всех автомобилей
     try:
-        cars = session.query(Cars).all()
-        for car in cars:
-            car.age = calculate_age(car.inventoried)
-            car.age_last_updated = today  # Сохраняем дату обновления
+        # Одним UPDATE обновляем только строки, которые сегодня еще не обновлялись
+        updated = session.execute(
+            update(Cars)
+            .where(Cars.age_last_updated.is_distinct_from(today))
+            .values(age=Cars.current_age, payback=Cars.current_payback, age_last_updated=today)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated:
+            bump_data_version(session)
         session.commit()
-        print("Age обновлен для всех автомобилей.")
+        if updated:
+            refresh_analytics([])  # Изменились только Cars
+            print(f"Age обновлен для {updated} автомобилей.")
+        else:
+            print("Age уже обновлен сегодня.")
     except Exception as e:
         session.rollback()
         print(f"Ошибка при обновлении age: {e}")
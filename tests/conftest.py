@@ -0,0 +1,55 @@
+"""
+Общие настройки тестов.
+
+Тесты с фикстурой database работают с отдельной базой Postgres: TEST_DATABASE_URL или временный
+сервер через пакет pgserver (pip install pgserver), как benchmarks.run_benchmarks --embedded.
+Без них такие тесты пропускаются. Движок приложения создается при первом импорте database.db,
+поэтому config настраивается здесь, до импорта модулей приложения.
+
+Запуск: python -m pytest -q
+"""
+import os
+import tempfile
+import pytest
+import config
+
+ANALYTICS_TMP = tempfile.mkdtemp(prefix="allamuchy_test_analytics_")
+DATA_TABLES = "cars, profits, car_latest_state, imports, portfolio_daily, import_jobs"
+
+
+def _test_database_url():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="allamuchy_test_pg_"), cleanup_mode="delete")
+    return server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+
+
+TEST_DATABASE_URL = _test_database_url()
+if TEST_DATABASE_URL:
+    config.DATABASE_URL = TEST_DATABASE_URL
+config.ANALYTICS_DIR = ANALYTICS_TMP
+config.IMPORT_UPLOAD_DIR = os.path.join(ANALYTICS_TMP, "uploads")
+
+
+@pytest.fixture(scope="session")
+def _schema():
+    if not TEST_DATABASE_URL:
+        pytest.skip("Нет тестовой базы: задайте TEST_DATABASE_URL или установите pgserver")
+    from database.create_tables import create_database
+    create_database()
+
+
+@pytest.fixture
+def database(_schema):
+    """Пустая схема приложения в тестовой базе; возвращает движок."""
+    from sqlalchemy import text
+    from database.db import engine
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {DATA_TABLES} RESTART IDENTITY"))
+        connection.execute(text("UPDATE data_version SET version = 0"))
+    return engine
@@ -0,0 +1,72 @@
+from datetime import date
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from services.import_service import import_data_from_excel
+
+# История одной машины с пропуском sales во втором снимке: прирост третьего снимка
+# считается от последнего известного cumulative_amount, а не от нуля
+HISTORY = [
+    (date(2024, 1, 10), 3565.22),
+    (date(2024, 2, 10), None),
+    (date(2024, 3, 10), 4053.60),
+]
+EXPECTED_CHANGES = [3565.22, 0.0, 488.38]
+
+
+def _write_snapshot(path, sales):
+    pd.DataFrame([
+        {"vstockno": 10415, "manufacturer": "Ford", "cost": 1200.0, "sales": sales},
+        {"vstockno": 10416, "manufacturer": "Honda", "cost": 400.0, "sales": 100.0},
+    ]).to_csv(path, index=False)
+    return str(path)
+
+
+def _change_amounts(engine, stockn=10415) -> list:
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT change_amount FROM profits WHERE stockn = :stockn ORDER BY date"), {"stockn": stockn}
+        ).scalars().all()
+
+
+def test_sequential_import_skips_null_cumulative(database, tmp_path):
+    for snapshot_date, sales in HISTORY:
+        result = import_data_from_excel(_write_snapshot(tmp_path / f"{snapshot_date}.csv", sales),
+                                        snapshot_date.strftime("%Y-%m-%d"))
+        assert result["error"] is None
+
+    assert _change_amounts(database) == pytest.approx(EXPECTED_CHANGES)
+
+
+def test_recompute_skips_null_cumulative(database, tmp_path):
+    from database.db import session_scope
+    from services.calculate import recompute_change_amounts
+    # Снимки загружаются задним числом (последний первым), поэтому итог дает пересчет истории
+    for snapshot_date, sales in reversed(HISTORY):
+        import_data_from_excel(_write_snapshot(tmp_path / f"{snapshot_date}.csv", sales),
+                               snapshot_date.strftime("%Y-%m-%d"))
+    assert _change_amounts(database) == pytest.approx(EXPECTED_CHANGES)
+
+    with session_scope() as session:
+        assert recompute_change_amounts(session) == []
+
+
+
+def test_batch_change_amounts_skip_null_cumulative(database, tmp_path):
+    from database.db import session_scope
+    from services.import_service import _compute_change_amounts
+    # Начальное значение пакета — последний известный cumulative_amount до пакета, пропуск внутри пакета
+    # не обнуляет базу следующего снимка
+    for snapshot_date, sales in HISTORY[:2]:
+        import_data_from_excel(_write_snapshot(tmp_path / f"{snapshot_date}.csv", sales),
+                               snapshot_date.strftime("%Y-%m-%d"))
+    batch = pd.DataFrame({
+        "stockn": [10415, 10415, 10415],
+        "date": [date(2024, 3, 10), date(2024, 4, 10), date(2024, 5, 10)],
+        "cumulative_amount": [4053.60, None, 4100.0],
+    })
+
+    with session_scope() as session:
+        changes = _compute_change_amounts(session, batch)
+
+    assert changes.sort_values("date")["change_amount"].tolist() == pytest.approx([488.38, 0.0, 46.40])
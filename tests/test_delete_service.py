@@ -0,0 +1,37 @@
+from datetime import date
+import pandas as pd
+from sqlalchemy import text
+from services.delete_service import delete_import, get_imports
+from services.import_service import import_data_from_excel
+
+# 1350 / 1200 = 1.125: половина округляется к четному, как при импорте (1.12, а не 1.13);
+# у машины с нулевой стоимостью profit есть, xs нет
+CARS = [
+    {"vstockno": 10666, "manufacturer": "Ford", "cost": 1200.0, "sales": 1350.0},
+    {"vstockno": 10667, "manufacturer": "Honda", "cost": 0.0, "sales": 75.5},
+    {"vstockno": 10668, "manufacturer": "Jeep", "cost": 800.0, "sales": 1003.0},
+]
+
+
+def _import(tmp_path, snapshot_date, cars):
+    path = tmp_path / f"{snapshot_date}.csv"
+    pd.DataFrame(cars).to_csv(path, index=False)
+    assert import_data_from_excel(str(path), snapshot_date.strftime("%Y-%m-%d"))["error"] is None
+
+
+def _profit_xs(engine) -> list:
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(text("SELECT stockn, profit, xs FROM cars ORDER BY stockn"))]
+
+
+def test_delete_recalculates_profit_xs_like_import(database, tmp_path):
+    _import(tmp_path, date(2024, 1, 10), CARS)
+    imported = _profit_xs(database)
+    assert imported == [(10666, 150, 1.12), (10667, 75, None), (10668, 203, 1.25)]
+
+    # Более поздний снимок меняет profit/xs; после его удаления значения пересчитываются в SQL
+    _import(tmp_path, date(2024, 2, 10), [dict(car, sales=car["sales"] + 500) for car in CARS])
+    assert _profit_xs(database) != imported
+    delete_import(get_imports()[0].id)
+
+    assert _profit_xs(database) == imported
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database.db import session_scope
+from database.models import ImportJob
+from services import job_service
+
+
+def _finished_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _add_job(owner, heartbeat_at) -> int:
+    with session_scope() as session:
+        job = ImportJob(status="running", file_name="yard.csv", owner=owner, heartbeat_at=heartbeat_at)
+        session.add(job)
+        session.flush()
+        return job.id
+
+
+def _statuses(engine) -> dict:
+    with engine.connect() as connection:
+        return dict(connection.execute(text("SELECT id, status FROM import_jobs")).all())
+
+
+def test_only_interrupted_jobs_of_other_processes_fail(database):
+    now = datetime.now()
+    stale = now - timedelta(seconds=job_service.config.IMPORT_JOB_LEASE_SECONDS + 60)
+    own = _add_job(job_service.PROCESS_OWNER, stale)
+    other_host = _add_job("other-host:4242:abcd1234", now)
+    other_host_stale = _add_job("other-host:4242:abcd1234", stale)
+    exited = _add_job(f"{job_service.PROCESS_HOST}:{_finished_pid()}:abcd1234", now)
+    legacy = _add_job(None, None)
+
+    job_service._fail_interrupted_jobs()
+
+    assert _statuses(database) == {
+        own: "running",
+        other_host: "running",
+        other_host_stale: "failed",
+        exited: "failed",
+        legacy: "failed",
+    }
+
+
+def test_heartbeat_renews_own_jobs(database):
+    stale = datetime.now() - timedelta(hours=1)
+    own = _add_job(job_service.PROCESS_OWNER, stale)
+    other = _add_job("other-host:4242:abcd1234", stale)
+
+    job_service._heartbeat()
+
+    with database.connect() as connection:
+        heartbeats = dict(connection.execute(text("SELECT id, heartbeat_at FROM import_jobs")).all())
+    assert heartbeats[own] > stale and heartbeats[other] == stale
@@ -0,0 +1,42 @@
+from datetime import date
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from database.db import session_scope
+from services.calculate import recompute_change_amounts
+from services.import_service import import_data_from_excel
+from services.partition_service import compact_profits
+
+# Месяц ежедневных снимков, последний из которых без sales, и снимок следующего месяца
+SNAPSHOTS = [
+    (date(2020, 3, 5), 100.0),
+    (date(2020, 3, 12), 150.0),
+    (date(2020, 3, 20), None),
+    (date(2020, 4, 5), 210.0),
+]
+
+
+def _import(tmp_path, snapshot_date, sales):
+    path = tmp_path / f"{snapshot_date}.csv"
+    pd.DataFrame([{"vstockno": 10420, "manufacturer": "Ford", "cost": 500.0, "sales": sales}]).to_csv(path, index=False)
+    assert import_data_from_excel(str(path), snapshot_date.strftime("%Y-%m-%d"))["error"] is None
+
+
+def test_compaction_keeps_last_known_cumulative(database, tmp_path):
+    for snapshot_date, sales in SNAPSHOTS:
+        _import(tmp_path, snapshot_date, sales)
+
+    assert compact_profits(keep_months=1)["months_compacted"] == 1
+
+    with database.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT date, cumulative_amount, change_amount FROM profits WHERE stockn = 10420 ORDER BY date"
+        )).all()
+    assert [tuple(row) for row in rows] == [(date(2020, 3, 12), 150.0, 150.0), (date(2020, 4, 5), 210.0, 60.0)]
+
+    # Сжатая история согласована с полным пересчетом change_amount
+    with session_scope() as session:
+        assert recompute_change_amounts(session) == []
+    with database.connect() as connection:
+        latest = connection.execute(text("SELECT cumulative_amount FROM car_latest_state WHERE stockn = 10420")).scalar()
+    assert latest == pytest.approx(210.0)
@@ -0,0 +1,72 @@
+from datetime import date
+import pandas as pd
+from services.table_service import diff_frames
+
+
+def _cars():
+    return pd.DataFrame({
+        "id": [1, 2, 3],
+        "stockn": [10401, 10402, 10403],
+        "color": ["Red", "Blue", None],
+        "cost": [1000.0, 2500.5, 400.0],
+        "dismantled": [date(2024, 1, 5), None, None],
+    })
+
+
+def _as_grid(frame: pd.DataFrame) -> pd.DataFrame:
+    """Данные в том виде, в каком их возвращает грид: даты строками, пустые значения — None."""
+    grid = frame.copy()
+    grid["dismantled"] = grid["dismantled"].map(lambda value: value.isoformat() if value else None)
+    return grid.astype(object).where(grid.notna(), None)
+
+
+def test_unchanged_grid_has_no_changes():
+    values, changed = diff_frames(_cars(), _as_grid(_cars()))
+    assert values.empty and changed.empty
+
+
+def test_filtered_grid_ignores_hidden_rows():
+    original = _cars()
+    grid = _as_grid(original).iloc[[0]]
+    grid.loc[0, "color"] = "Green"
+
+    values, changed = diff_frames(original, grid)
+
+    assert values.index.tolist() == [1]
+    assert changed.loc[1].to_dict() == {"color": True, "cost": False, "dismantled": False}
+    assert values.loc[1, "color"] == "Green"
+
+
+def test_sorted_grid_matches_rows_by_id():
+    original = _cars()
+    grid = _as_grid(original).iloc[::-1].reset_index(drop=True)
+    grid.loc[grid["id"] == 2, "cost"] = 2600
+
+    values, changed = diff_frames(original, grid)
+
+    assert values.index.tolist() == [2]
+    assert changed.loc[2, "cost"] and not changed.loc[2, "color"]
+    assert values.loc[2, "cost"] == 2600
+
+
+def test_subset_grid_with_cleared_value():
+    original = _cars()
+    grid = _as_grid(original).iloc[[2, 0]]
+    grid.loc[0, "dismantled"] = None
+
+    values, changed = diff_frames(original, grid)
+
+    assert values.index.tolist() == [1]
+    assert changed.loc[1].tolist() == [False, False, True]
+    assert values.loc[1, "dismantled"] is None
+
+
+def test_readonly_columns_are_not_compared():
+    original = _cars()
+    grid = _as_grid(original)
+    grid.loc[0, "stockn"] = 99999
+    grid.loc[1, "cost"] = 1.0
+
+    values, changed = diff_frames(original, grid, readonly=("id", "stockn", "cost"))
+
+    assert values.empty and changed.empty